@@ -0,0 +1,192 @@
+import numpy as np
+
+from picks import picks_from_columns
+
+# Fraction of the peak amplitude at which the peak width is measured
+PEAK_WIDTH_LEVEL = 0.5
+# Least contrast (see pick_contrast) of a pick over its column. Ridges of
+# the sample records stand out by about 0.9, columns of pure noise by 0.5
+# to 0.65.
+DEFAULT_MIN_CONTRAST = 0.75
+
+
+def refine_peaks(grid, rows, cols):
+    '''
+    Sub-pixel peak positions from a parabola through each peak and its two
+    neighbours. Returns fractional row offsets in [-0.5, 0.5].
+    '''
+    n_rows = grid.shape[0]
+    y0 = grid[np.clip(rows - 1, 0, n_rows - 1), cols]
+    y1 = grid[rows, cols]
+    y2 = grid[np.clip(rows + 1, 0, n_rows - 1), cols]
+    denom = y0 - 2 * y1 + y2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offsets = np.where(denom < 0, 0.5 * (y0 - y2) / denom, 0.0)
+    # Peaks on the edge of the grid have no neighbour on one side
+    offsets[(rows == 0) | (rows == n_rows - 1)] = 0.0
+    return np.clip(offsets, -0.5, 0.5)
+
+
+def peak_half_widths(grid, rows, cols, level=PEAK_WIDTH_LEVEL):
+    '''
+    Half width, in rows, of the contiguous region around each peak where
+    the column stays above `level` times the peak amplitude.
+    '''
+    columns = grid[:, cols]
+    below = columns < level * grid[rows, cols]
+    row_index = np.arange(grid.shape[0])[:, None]
+    upper = np.where(below & (row_index > rows), row_index, grid.shape[0]).min(axis=0)
+    lower = np.where(below & (row_index < rows), row_index, -1).max(axis=0)
+    return (upper - lower - 1) / 2
+
+
+def pick_contrast(amplitude, background):
+    '''
+    How far a pick stands out from its column's median `background`:
+    1 - background / amplitude, so 1 over an empty column and 0 or less
+    for a pick no stronger than the column's typical value. Unlike the
+    amplitude, it does not depend on how the column is normalized.
+    '''
+    amplitude = np.asarray(amplitude, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(amplitude > 0, 1 - background / amplitude, 0.0)
+
+
+def track_ridge(grid, columns, max_jump, min_contrast=DEFAULT_MIN_CONTRAST):
+    '''
+    Follow the strongest ridge through the given grid columns.
+
+    Tracking starts at the column whose peak has the highest contrast
+    (see pick_contrast) and moves outwards in both directions. The global
+    peak of a column is used when it lies within `max_jump` rows of the
+    previous pick; otherwise the peak is searched in that window only.
+    Columns whose pick has a contrast below `min_contrast` are skipped.
+    Returns one row per column, -1 where nothing was picked.
+    '''
+    rows = np.full(grid.shape[1], -1)
+    if len(columns) == 0 or grid.shape[0] == 0:
+        return rows
+    peaks = grid[:, columns].argmax(axis=0)
+    background = np.median(grid[:, columns], axis=0)
+    contrast = pick_contrast(grid[peaks, columns], background)
+    anchor = int(contrast.argmax())
+    if contrast[anchor] < min_contrast:
+        return rows
+    rows[columns[anchor]] = peaks[anchor]
+
+    for step in (1, -1):
+        previous = peaks[anchor]
+        position = anchor + step
+        while 0 <= position < len(columns):
+            col = columns[position]
+            row = peaks[position]
+            if abs(row - previous) > max_jump:
+                lo = max(previous - max_jump, 0)
+                hi = min(previous + max_jump + 1, grid.shape[0])
+                row = lo + int(grid[lo:hi, col].argmax())
+            if pick_contrast(grid[row, col], background[position]) >= min_contrast:
+                rows[col] = row
+                previous = row
+            position += step
+    return rows
+
+
+def autopick_grid(
+        grid,
+        freq,
+        slow,
+        min_frequency=None,
+        max_frequency=None,
+        max_jump=None,
+        min_contrast=DEFAULT_MIN_CONTRAST,
+):
+    '''
+    Automatically pick the dispersion curve on a (n_slow, n_freq) grid.
+
+    Returns a pick array (see picks.PICK_DTYPE) with one pick per tracked
+    frequency, never on the first or last slowness row and only with a
+    positive slowness. Beyond frequency and slowness, the .pck columns are filled
+    as: d1 the grid amplitude at the pick, d2 the frequency index, d3 the
+    fractional slowness index, d4 zero and d5 the slowness uncertainty,
+    taken as the half width of the peak at half its amplitude.
+    `max_jump` is the largest slowness change allowed between neighbouring
+    frequencies, in slowness units; by default 5% of the slowness range.
+    Frequencies where the ridge does not stand out from the column by at
+    least `min_contrast` (see pick_contrast) are left unpicked.
+    '''
+    grid = np.nan_to_num(np.asarray(grid, dtype=np.float64))
+    freq = np.asarray(freq, dtype=np.float64)
+    slow = np.asarray(slow, dtype=np.float64)
+    if grid.shape != (len(slow), len(freq)):
+        raise ValueError("Grid shape does not match the frequency and slowness axes.")
+
+    selected = freq > 0
+    if min_frequency is not None:
+        selected &= freq >= min_frequency
+    if max_frequency is not None:
+        selected &= freq <= max_frequency
+    columns = np.flatnonzero(selected)
+
+    slow_step = abs(slow[1] - slow[0]) if len(slow) > 1 else 1.0
+    if max_jump is None:
+        max_jump_rows = max(1, int(round(0.05 * len(slow))))
+    else:
+        max_jump_rows = max(1, int(round(max_jump / slow_step)))
+
+    # Picks are confined to interior rows, which have a neighbour on both
+    # sides for refinement; the first row is also zero slowness on the usual axis
+    rows = track_ridge(grid[1:-1], columns, max_jump_rows, min_contrast)
+    cols = np.flatnonzero(rows >= 0)
+    rows = rows[cols] + 1
+
+    fractional_rows = rows + refine_peaks(grid, rows, cols)
+    values = np.zeros((len(cols), 7))
+    values[:, 0] = grid[rows, cols]
+    values[:, 1] = cols
+    values[:, 2] = freq[cols]
+    values[:, 3] = fractional_rows
+    values[:, 4] = np.interp(fractional_rows, np.arange(len(slow)), slow)
+    values[:, 6] = peak_half_widths(grid, rows, cols) * slow_step
+    return picks_from_columns(values[values[:, 4] > 0])
+
+
+def combine_picks(pick_sets, weights, freq):
+    '''
+    Weighted combination of several records' picks on the shared frequency
+    axis. At each frequency index (d2) picked by at least one record, the
+    slowness is the weighted mean over those records and d5 the weighted
+    spread, combining each record's own uncertainty with its distance from
+    the mean. d1 is the weighted mean amplitude and d4 the number of
+    contributing records.
+    '''
+    freq = np.asarray(freq, dtype=np.float64)
+    used = [(p, w) for p, w in zip(pick_sets, weights) if len(p) and w > 0]
+    if not used:
+        return picks_from_columns(np.zeros((0, 7)))
+    picks = np.concatenate([p for p, _ in used])
+    weight = np.concatenate([np.full(len(p), w, dtype=np.float64) for p, w in used])
+    index = picks["d2"].astype(np.intp)
+
+    def weighted_sum(values):
+        return np.bincount(index, weights=weight * values, minlength=len(freq))
+
+    total = weighted_sum(np.ones(len(picks)))
+    counts = np.bincount(index, minlength=len(freq))
+    cols = np.flatnonzero(total > 0)
+
+    def weighted_mean(values):
+        return weighted_sum(values)[cols] / total[cols]
+
+    mean_slowness = np.zeros(len(freq))
+    mean_slowness[cols] = weighted_mean(picks["slowness"])
+    spread = weighted_mean(picks["d5"] ** 2 + (picks["slowness"] - mean_slowness[index]) ** 2)
+
+    values = np.zeros((len(cols), 7))
+    values[:, 0] = weighted_mean(picks["d1"])
+    values[:, 1] = cols
+    values[:, 2] = freq[cols]
+    values[:, 3] = weighted_mean(picks["d3"])
+    values[:, 4] = mean_slowness[cols]
+    values[:, 5] = counts[cols]
+    values[:, 6] = np.sqrt(spread)
+    return picks_from_columns(values)
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+
+def hash_arrays(*arrays):
+    '''
+    Stable hex digest of the contents, dtypes and shapes of the given arrays.
+    '''
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype).encode())
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class LRUByteCache:
+    '''
+    Least-recently-used cache bounded by the total size of its values.
+    Sizes are taken from `nbytes` unless a size is passed explicitly.
+    Values larger than the whole budget are not cached.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key][0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = value.nbytes
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def stats(self):
+        return {
+            "entries": len(self._items),
+            "bytes": self.current_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class DiskResultCache:
+    '''
+    Content-addressed cache of processed arrays stored as .npy files.
+
+    Keys are built from a digest of the source file's bytes and a digest of
+    the processing parameters, so identical uploads processed the same way
+    share an entry. Total size is bounded by `max_bytes`, evicting the least
+    recently used files first (by modification time, refreshed on hits).
+    '''
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.current_bytes = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def make_key(file_digest, params_digest):
+        return hashlib.sha256(f"{file_digest}:{params_digest}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            array = np.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, key, array):
+        path = self._path(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        with self._lock:
+            if os.path.exists(path):
+                self.current_bytes -= os.path.getsize(path)
+            os.replace(temp_path, path)
+            self.current_bytes += os.path.getsize(path)
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.current_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.current_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                os.remove(path)
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries()),
+            "bytes": self.current_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+
+from cache import LRUByteCache, hash_arrays
+from segy import SegyFile
+from utils import get_traces_from_sgy
+
+# Steering tensors are shared by every record with the same geometry and axes.
+# Each worker process keeps its own cache for the lifetime of the pool;
+# STEERING_CACHE_MAX_BYTES is the total, split evenly between the workers.
+STEERING_CACHE_MAX_BYTES = int(os.environ.get("STEERING_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+steering_cache = LRUByteCache(STEERING_CACHE_MAX_BYTES)
+
+
+def set_steering_cache_share(n_workers):
+    '''Worker initializer: limit this process's cache to its share of the total.'''
+    steering_cache.max_bytes = STEERING_CACHE_MAX_BYTES // max(1, n_workers)
+
+# Traces decoded per rFFT batch when streaming a record from disk
+TRACE_BLOCK_SIZE = 256
+
+
+def get_freq_axis(max_frequency, num_freq_points):
+    return np.linspace(0.0, max_frequency, num_freq_points)
+
+
+def get_slow_axis(max_slowness, num_slow_points):
+    return np.linspace(0.0, max_slowness, num_slow_points)
+
+
+def get_offsets_from_geometry(geometry):
+    '''
+    Receiver offsets along the spread, measured as the horizontal distance
+    from the first receiver. Geometry items are expected in trace order.
+    '''
+    xy = np.array([[item["x"], item["y"]] for item in geometry], dtype=np.float64)
+    if len(xy) == 0:
+        raise ValueError("No geometry points provided.")
+    delta = xy - xy[0]
+    return np.hypot(delta[:, 0], delta[:, 1])
+
+
+def build_steering_matrix(offsets, freq, slow):
+    '''
+    Phase-shift steering tensor exp(i*2*pi*f*s*x) with shape
+    (n_freq, n_slow, n_traces).
+    '''
+    phase = (2.0 * np.pi) * freq[:, None, None] * slow[None, :, None] * offsets[None, None, :]
+    return np.exp(1j * phase.astype(np.float32))
+
+
+def get_steering_matrix(offsets, freq, slow):
+    '''
+    Cached version of build_steering_matrix keyed by the geometry offsets
+    and both axes. The returned array is read-only.
+    '''
+    key = hash_arrays(offsets, freq, slow)
+    steering = steering_cache.get(key)
+    if steering is None:
+        steering = build_steering_matrix(offsets, freq, slow)
+        steering.flags.writeable = False
+        steering_cache.put(key, steering)
+    return steering
+
+
+def get_fft_length(n_samples):
+    return 1 << int(np.ceil(np.log2(max(n_samples, 2))))
+
+
+def get_spectrum_at_freqs(traces, dt, freq, n_fft=None):
+    '''
+    Single batched rFFT over all traces, linearly interpolated onto the
+    requested frequency axis. Returns an (n_freq, n_traces) complex array.
+    Frequencies above Nyquist are returned as zeros.
+    '''
+    if n_fft is None:
+        n_fft = get_fft_length(traces.shape[1])
+    spectrum = np.fft.rfft(traces, n=n_fft, axis=1)
+
+    position = freq * (n_fft * dt)
+    lower = np.floor(position).astype(np.int64)
+    valid = lower < spectrum.shape[1] - 1
+    lower = np.where(valid, lower, 0)
+    weight = (position - lower)[None, :]
+    values = spectrum[:, lower] * (1.0 - weight) + spectrum[:, lower + 1] * weight
+    values[:, ~valid] = 0.0
+    return values.T
+
+
+def get_record_spectrum(segyfile, freq):
+    '''
+    Spectrum of a record at the requested frequencies. Traces are decoded
+    from the memory-mapped file in blocks, so memory use does not grow with
+    record length times trace count. Falls back to segyio for files the
+    memory-mapped reader cannot handle.
+    '''
+    try:
+        reader = SegyFile(segyfile)
+    except ValueError:
+        traces, dt = get_traces_from_sgy(segyfile)
+        return get_spectrum_at_freqs(traces, dt, freq)
+    with reader:
+        n_fft = get_fft_length(reader.n_samples)
+        return np.concatenate([
+            get_spectrum_at_freqs(traces, reader.sample_interval, freq, n_fft)
+            for _, traces in reader.iter_trace_blocks(TRACE_BLOCK_SIZE)
+        ], axis=1)
+
+
+def compute_dispersion_grid_from_spectrum(spectrum, offsets, freq, slow, steering=None):
+    '''
+    Phase-shift (Park et al., 1998) frequency-slowness transform of an
+    (n_freq, n_traces) spectrum. Offsets are in the same distance units as
+    1/slow. Returns a float32 grid shaped (n_slow, n_freq) with each
+    frequency column normalized to a peak of 1.
+    '''
+    if spectrum.shape[1] != len(offsets):
+        raise ValueError(
+            f"Trace count ({spectrum.shape[1]}) does not match geometry count ({len(offsets)})."
+        )
+    magnitude = np.abs(spectrum)
+    spectrum = np.divide(spectrum, magnitude, out=np.zeros_like(spectrum), where=magnitude > 0)
+
+    if steering is None:
+        steering = build_steering_matrix(offsets, freq, slow)
+    power = np.abs(np.matmul(steering, spectrum.astype(np.complex64)[:, :, None])[:, :, 0])
+
+    peak = power.max(axis=1, keepdims=True)
+    power = np.divide(power, peak, out=np.zeros_like(power), where=peak > 0)
+    return np.ascontiguousarray(power.T, dtype=np.float32)
+
+
+def compute_dispersion_grid(traces, dt, offsets, freq, slow, steering=None):
+    '''
+    Phase-shift transform of (n_traces, n_samples) traces sampled every dt
+    seconds. See compute_dispersion_grid_from_spectrum.
+    '''
+    spectrum = get_spectrum_at_freqs(np.asarray(traces, dtype=np.float64), dt, freq)
+    return compute_dispersion_grid_from_spectrum(spectrum, offsets, freq, slow, steering=steering)
+
+
+def compute_grid_from_sgy(segyfile, offsets, freq, slow):
+    spectrum = get_record_spectrum(segyfile, freq)
+    steering = get_steering_matrix(offsets, freq, slow)
+    return compute_dispersion_grid_from_spectrum(spectrum, offsets, freq, slow, steering=steering)
@@ -0,0 +1,457 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from velmodel import model_from_layers, phase_velocities, VP_VS_RATIO, PHASE_VEL_DELTA, DEFAULT_DENSITY
+
+# Rayleigh to shear velocity ratio of a half-space with Vp = Vs * sqrt(3),
+# the long-period limit of the fundamental mode
+RAYLEIGH_VS_RATIO = np.sqrt(2 - 2 / np.sqrt(3))
+# Lowest phase velocity searched, as a fraction of the slowest layer's Vs
+SEARCH_MIN_RATIO = 0.8
+# Relative step of the finite-difference Jacobian, well above the solver's accuracy
+JACOBIAN_STEP = 1e-3
+DEFAULT_MAX_ITERATIONS = 30
+DEFAULT_DAMPING = 1e-2
+DAMPING_FACTOR = 4.0
+MAX_DAMPING = 1e8
+# Largest change of a log parameter in one step, a factor of e. Longer
+# steps raise the damping instead of being accepted.
+MAX_LOG_STEP = 1.0
+# Stop once STALL_ITERATIONS accepted steps in a row each improve the misfit
+# by less than this fraction; a single small step is often just heavily damped
+DEFAULT_TOLERANCE = 1e-4
+STALL_ITERATIONS = 3
+
+# Global search settings
+DEFAULT_SAMPLES_PER_GENERATION = 500
+DEFAULT_MAX_GENERATIONS = 30
+# Best models resampled around in each generation
+DEFAULT_RESAMPLED_MODELS = 20
+DEFAULT_ENSEMBLE_SIZE = 50
+DEFAULT_BEST_MODELS = 50
+# Generations without a relative improvement of the best misfit of at
+# least `tolerance` before the search stops
+DEFAULT_PATIENCE = 4
+DEFAULT_SEARCH_TOLERANCE = 1e-3
+# Default bounds, as factors of the starting model's values
+DEFAULT_BOUND_RATIO = 2.0
+# Smallest sampling spread, as a fraction of each parameter's bounds
+MIN_SPREAD = 0.01
+# Decimals kept in rebuilt layer depths, dropping float noise from summing thicknesses
+DEPTH_DECIMALS = 6
+
+
+def observed_curve(picks):
+    '''
+    (periods, velocities) of the picks with a positive frequency and
+    slowness, the data the frontend's RMSE is computed against.
+    '''
+    valid = (picks["frequency"] > 0) & (picks["slowness"] > 0)
+    if not valid.any():
+        raise ValueError("No picks with a positive frequency and slowness.")
+    return 1 / picks["frequency"][valid], 1 / picks["slowness"][valid]
+
+
+def predicted_velocities(periods, thickness, vs, rho, phase_vel_min=None):
+    '''
+    Phase velocities of a batch of models (arrays of shape batch +
+    (n_layers,)) with Vp = Vs * sqrt(3) at 1-D `periods`. Unless given,
+    each model's scan starts below its slowest layer. Where no root is
+    found the half-space Rayleigh velocity is used instead, so misfits
+    stay finite.
+    '''
+    vs = np.asarray(vs, dtype=np.float64)
+    if phase_vel_min is None:
+        phase_vel_min = SEARCH_MIN_RATIO * vs.min(axis=-1, keepdims=True)
+    velocities = phase_velocities(
+        periods, thickness, vs * VP_VS_RATIO, vs, rho, phase_vel_min, vs.max(), PHASE_VEL_DELTA,
+    )
+    fallback = RAYLEIGH_VS_RATIO * vs[..., -1:]
+    return np.where(np.isnan(velocities), fallback, velocities)
+
+
+def scan_starts(velocities, phase_vel_min):
+    '''
+    Per-period scan starts a few grid steps below known roots, on the
+    grid that starts at `phase_vel_min`, so slightly perturbed models
+    find the same roots without scanning from the bottom.
+    '''
+    steps = np.floor((velocities - phase_vel_min) / PHASE_VEL_DELTA) - 2
+    return phase_vel_min + PHASE_VEL_DELTA * np.maximum(steps, 0)
+
+
+def rms(residuals):
+    return np.sqrt(np.mean(residuals ** 2, axis=-1))
+
+
+def model_misfits(periods, observed, thickness, vs, rho):
+    '''Velocity RMSE of each model in a batch against observed (period, velocity) pairs.'''
+    periods, inverse = np.unique(periods, return_inverse=True)
+    return rms(predicted_velocities(periods, thickness, vs, rho)[..., inverse] - observed)
+
+
+def check_models(thickness, vs, rho=None):
+    '''
+    (thickness, vs, rho) float arrays of shape (n_models, n_layers) from
+    per-model rows, with densities of DEFAULT_DENSITY when not given. The
+    last layer is the half-space and its thickness is ignored.
+    '''
+    vs = np.asarray(vs, dtype=np.float64)
+    if vs.ndim != 2 or vs.shape[1] == 0:
+        raise ValueError("Velocities must be an (n_models, n_layers) array.")
+    rho = np.full(vs.shape, DEFAULT_DENSITY) if rho is None else rho
+    thickness, rho = (np.asarray(values, dtype=np.float64) for values in (thickness, rho))
+    if thickness.shape != vs.shape or rho.shape != vs.shape:
+        raise ValueError("Thickness, velocity and density arrays must have the same shape.")
+    if np.any(vs <= 0) or np.any(rho <= 0) or np.any(thickness[:, :-1] <= 0):
+        raise ValueError("Velocities, densities and thicknesses must be positive.")
+    return thickness, vs, rho
+
+
+def misfits_for_picks(picks, thickness, vs, rho=None):
+    '''
+    Velocity RMSE against the picks of each of n_models layer models,
+    given as (n_models, n_layers) arrays, in one batched solve.
+    '''
+    thickness, vs, rho = check_models(thickness, vs, rho)
+    periods, observed = observed_curve(picks)
+    return model_misfits(periods, observed, thickness, vs, rho)
+
+
+def layers_from_model(layers, thickness, vs):
+    '''
+    Copy of DisperSettingsModel layers with new thicknesses and
+    velocities. Depths are rebuilt from the top; the half-space keeps its
+    displayed thickness. Layers whose thickness is unchanged and which
+    still start at the same depth keep their depths exactly; other depths
+    are rounded to DEPTH_DECIMALS.
+    '''
+    result = []
+    depth = layers[0]["startDepth"]
+    for layer, layer_thickness, velocity in zip(layers, thickness, vs):
+        if len(result) == len(layers) - 1:
+            layer_thickness = layer["endDepth"] - layer["startDepth"]
+        unchanged = depth == layer["startDepth"] and layer_thickness == layer["endDepth"] - layer["startDepth"]
+        end_depth = layer["endDepth"] if unchanged else round(float(depth + layer_thickness), DEPTH_DECIMALS)
+        result.append({
+            **layer,
+            "startDepth": float(depth),
+            "endDepth": float(end_depth),
+            "velocity": float(velocity),
+        })
+        depth = end_depth
+    return result
+
+
+def invert_layers(
+        layers,
+        picks,
+        fit_thickness=True,
+        max_iterations=DEFAULT_MAX_ITERATIONS,
+        damping=DEFAULT_DAMPING,
+        tolerance=DEFAULT_TOLERANCE,
+):
+    '''
+    Levenberg-Marquardt fit of layer shear velocities, and optionally
+    thicknesses, to the picks, starting from `layers`. Parameters are
+    inverted as logarithms so they stay positive, and the Jacobian is
+    taken by forward differences with the model and all its perturbed
+    copies solved in one batched call. Densities and the half-space
+    thickness are held fixed.
+
+    Returns the fitted layers in DisperSettingsModel form with the
+    velocity RMSE before and after and the number of iterations.
+    '''
+    thickness, _, vs, rho = model_from_layers(layers)
+    periods, observed = observed_curve(picks)
+    # Solve each distinct period once
+    periods, inverse = np.unique(periods, return_inverse=True)
+    n_layers = len(vs)
+    n_thickness = n_layers - 1 if fit_thickness else 0
+
+    def unpack(x):
+        x = np.exp(x)
+        fitted_thickness = np.broadcast_to(thickness, x.shape[:-1] + (n_layers,)).copy()
+        fitted_thickness[..., :n_thickness] = x[..., n_layers:]
+        return fitted_thickness, x[..., :n_layers]
+
+    def predict(x, phase_vel_min=None):
+        fitted_thickness, fitted_vs = unpack(x)
+        return predicted_velocities(periods, fitted_thickness, fitted_vs, rho, phase_vel_min)
+
+    def misfit_of(predicted):
+        return rms(predicted[inverse] - observed)
+
+    x = x_start = np.log(np.concatenate([vs, thickness[:n_thickness]]))
+    # Perturbed copies of the model, one per parameter
+    steps = JACOBIAN_STEP * np.eye(len(x))
+
+    predicted = predict(x)
+    initial_misfit = misfit = misfit_of(predicted)
+    iterations = stalled = 0
+    while iterations < max_iterations and damping < MAX_DAMPING:
+        iterations += 1
+        # The perturbed roots lie next to the current ones, on the same scan grid
+        phase_vel_min = SEARCH_MIN_RATIO * unpack(x)[1].min()
+        perturbed = predict(x + steps, scan_starts(predicted, phase_vel_min))
+        jacobian = ((perturbed - predicted) / JACOBIAN_STEP)[:, inverse].T
+        normal = jacobian.T @ jacobian
+        gradient = jacobian.T @ (predicted[inverse] - observed)
+        # Raise the damping until a step is short enough and lowers the misfit
+        while damping < MAX_DAMPING:
+            step = np.linalg.solve(normal + damping * np.diag(np.diag(normal) + 1e-12), -gradient)
+            # Too long a step means the damping is too low for the
+            # linearization to hold; clipping it would keep a poor direction
+            if np.abs(step).max() > MAX_LOG_STEP:
+                damping *= DAMPING_FACTOR
+                continue
+            trial = predict(x + step)
+            trial_misfit = misfit_of(trial)
+            if trial_misfit < misfit:
+                break
+            damping *= DAMPING_FACTOR
+        else:
+            break
+        x = x + step
+        predicted = trial
+        damping /= DAMPING_FACTOR
+        improvement = (misfit - trial_misfit) / misfit
+        misfit = trial_misfit
+        stalled = stalled + 1 if improvement < tolerance else 0
+        if stalled >= STALL_ITERATIONS:
+            break
+
+    # Parameters no step has changed are returned as given, without the
+    # rounding of the log round trip
+    fitted_thickness, fitted_vs = unpack(x)
+    unchanged = x == x_start
+    fitted_vs = np.where(unchanged[:n_layers], vs, fitted_vs)
+    fitted_thickness[:n_thickness] = np.where(unchanged[n_layers:], thickness[:n_thickness], fitted_thickness[:n_thickness])
+    return {
+        "layers": layers_from_model(layers, fitted_thickness, fitted_vs),
+        "misfit": float(misfit),
+        "initialMisfit": float(initial_misfit),
+        "iterations": iterations,
+    }
+
+
+def search_bounds(layers, velocity_bounds=None, thickness_bounds=None, ratio=DEFAULT_BOUND_RATIO):
+    '''
+    (low, high) parameter vectors for a global search: the shear velocity
+    of every layer followed by the thickness of every layer above the
+    half-space. Bounds not given span the starting model's values divided
+    and multiplied by `ratio`.
+    '''
+    thickness, _, vs, _ = model_from_layers(layers)
+    start = np.concatenate([vs, thickness[:-1]])
+    low, high = start / ratio, start * ratio
+    for offset, bounds, count in ((0, velocity_bounds, len(vs)), (len(vs), thickness_bounds, len(vs) - 1)):
+        if bounds is None:
+            continue
+        bounds = np.asarray(bounds, dtype=np.float64)
+        if bounds.shape != (count, 2):
+            raise ValueError(f"Expected {count} (min, max) bounds.")
+        low[offset:offset + count], high[offset:offset + count] = bounds[:, 0], bounds[:, 1]
+    if np.any(low <= 0) or np.any(high < low):
+        raise ValueError("Bounds must be positive with min <= max.")
+    return low, high
+
+
+class GlobalSearch:
+    '''
+    Monte Carlo search of layer models within bounds, in the spirit of the
+    neighbourhood algorithm: the first generation is sampled uniformly,
+    and each later one around the `resampled` best models found so far,
+    with a per-parameter spread matching that of those models, so sampling
+    narrows as they agree. The search stops after `max_generations` or
+    once the best misfit has not improved by `tolerance` for `patience`
+    generations.
+
+    The caller evaluates the misfits, e.g. in parallel with
+    model_misfits: candidates() returns the next generation as
+    (thickness, vs) batches and update() takes their misfits.
+    '''
+
+    def __init__(
+            self,
+            layers,
+            periods,
+            observed,
+            low,
+            high,
+            samples=DEFAULT_SAMPLES_PER_GENERATION,
+            max_generations=DEFAULT_MAX_GENERATIONS,
+            resampled=DEFAULT_RESAMPLED_MODELS,
+            patience=DEFAULT_PATIENCE,
+            tolerance=DEFAULT_SEARCH_TOLERANCE,
+            seed=None,
+    ):
+        self.layers = layers
+        self.thickness, _, _, self.rho = model_from_layers(layers)
+        self.periods, self.observed = periods, observed
+        self.low, self.high = low, high
+        self.samples = samples
+        self.max_generations = max_generations
+        self.resampled = resampled
+        self.patience = patience
+        self.tolerance = tolerance
+        if min(samples, max_generations, resampled, patience) < 1:
+            raise ValueError("Samples, generations, resampled models and patience must be at least 1.")
+        self.rng = np.random.default_rng(seed)
+        self.generation = 0
+        self.stalled = 0
+        self.models = np.zeros((0, len(low)))
+        self.misfits = np.zeros(0)
+        self._candidates = None
+
+    @classmethod
+    def from_picks(cls, layers, picks, low, high, **kwargs):
+        periods, observed = observed_curve(picks)
+        return cls(layers, periods, observed, low, high, **kwargs)
+
+    def state(self):
+        '''
+        Everything needed to resume the search between generations, as
+        JSON-safe settings and a dict of arrays.
+        '''
+        settings = {
+            "layers": self.layers,
+            "samples": self.samples,
+            "max_generations": self.max_generations,
+            "resampled": self.resampled,
+            "patience": self.patience,
+            "tolerance": self.tolerance,
+            "generation": self.generation,
+            "stalled": self.stalled,
+            "rng": self.rng.bit_generator.state,
+        }
+        arrays = {
+            "periods": self.periods,
+            "observed": self.observed,
+            "low": self.low,
+            "high": self.high,
+            "models": self.models,
+            "misfits": self.misfits,
+        }
+        return settings, arrays
+
+    @classmethod
+    def from_state(cls, settings, arrays):
+        search = cls(
+            settings["layers"],
+            arrays["periods"],
+            arrays["observed"],
+            arrays["low"],
+            arrays["high"],
+            samples=settings["samples"],
+            max_generations=settings["max_generations"],
+            resampled=settings["resampled"],
+            patience=settings["patience"],
+            tolerance=settings["tolerance"],
+        )
+        search.generation = settings["generation"]
+        search.stalled = settings["stalled"]
+        search.rng.bit_generator.state = settings["rng"]
+        search.models = arrays["models"]
+        search.misfits = arrays["misfits"]
+        return search
+
+    @property
+    def best_misfit(self):
+        return float(self.misfits.min()) if len(self.misfits) else None
+
+    @property
+    def done(self):
+        return self.generation >= self.max_generations or self.stalled >= self.patience
+
+    def unpack(self, x):
+        '''(thickness, vs) of parameter vectors; the half-space keeps its thickness.'''
+        n_layers = len(self.thickness)
+        thickness = np.broadcast_to(self.thickness, x.shape[:-1] + (n_layers,)).copy()
+        thickness[..., :-1] = x[..., n_layers:]
+        return thickness, x[..., :n_layers]
+
+    def candidates(self):
+        if self.generation == 0:
+            x = self.rng.uniform(self.low, self.high, (self.samples, len(self.low)))
+        else:
+            elite = self.models[np.argsort(self.misfits)[:self.resampled]]
+            spread = np.maximum(elite.std(axis=0), MIN_SPREAD * (self.high - self.low))
+            centres = elite[self.rng.integers(len(elite), size=self.samples)]
+            x = np.clip(centres + spread * self.rng.standard_normal(centres.shape), self.low, self.high)
+        self._candidates = x
+        return self.unpack(x)
+
+    def update(self, misfits):
+        previous = self.best_misfit
+        self.models = np.concatenate([self.models, self._candidates])
+        self.misfits = np.concatenate([self.misfits, misfits])
+        self._candidates = None
+        self.generation += 1
+        if previous is not None and previous - self.best_misfit < self.tolerance * previous:
+            self.stalled += 1
+        else:
+            self.stalled = 0
+
+    def model_layers(self, x):
+        thickness, vs = self.unpack(x)
+        return layers_from_model(self.layers, thickness, vs)
+
+    def best_layers(self):
+        return self.model_layers(self.models[self.misfits.argmin()]) if len(self.misfits) else None
+
+    def result(self, best_models=DEFAULT_BEST_MODELS, ensemble_size=DEFAULT_ENSEMBLE_SIZE):
+        '''
+        The best models in DisperSettingsModel form and, as uncertainty
+        bands, the min / median / max of each layer's velocity and
+        thickness over the `ensemble_size` best models. Before any model
+        has been evaluated there is no best model and the bands are None.
+        '''
+        order = np.argsort(self.misfits)
+        ensemble = self.models[order[:max(ensemble_size, 0)]]
+        thickness, vs = self.unpack(ensemble)
+
+        def bands(values):
+            if len(values) == 0:
+                return None
+            return {
+                "min": values.min(axis=0).tolist(),
+                "median": np.median(values, axis=0).tolist(),
+                "max": values.max(axis=0).tolist(),
+            }
+
+        return {
+            "layers": self.best_layers(),
+            "misfit": self.best_misfit,
+            "models": [
+                {"layers": self.model_layers(self.models[i]), "misfit": float(self.misfits[i])}
+                for i in order[:max(best_models, 0)]
+            ],
+            "ensemble": {"size": len(ensemble), "velocity": bands(vs), "thickness": bands(thickness)},
+            "generations": self.generation,
+            "evaluated": len(self.misfits),
+        }
+
+
+def save_checkpoint(path, search, metadata):
+    '''
+    Write the search state and caller metadata to an .npz file, replacing
+    any earlier checkpoint atomically.
+    '''
+    settings, arrays = search.state()
+    header = json.dumps({"search": settings, "metadata": metadata})
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, header=np.array(header), **arrays)
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    '''(search, metadata) from a checkpoint written by save_checkpoint.'''
+    with np.load(path, allow_pickle=False) as data:
+        header = json.loads(str(data["header"]))
+        arrays = {name: data[name] for name in data.files if name != "header"}
+    return GlobalSearch.from_state(header["search"], arrays), header["metadata"]
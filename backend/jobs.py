@@ -0,0 +1,309 @@
+import asyncio
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Finished jobs are kept around this long so clients can collect results
+JOB_TTL_SECONDS = 60 * 60
+
+
+class EventChannel:
+    '''
+    Fan-out of job events to any number of subscriber queues.
+    '''
+
+    def __init__(self):
+        self._queues = set()
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        self._queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._queues.discard(queue)
+
+    def publish(self, event):
+        for queue in self._queues:
+            queue.put_nowait(event)
+
+
+def lock_file(path):
+    '''
+    Open `path` and take an exclusive lock on it without waiting. Returns
+    the open file, which holds the lock until closed, or None if another
+    process holds it. The operating system releases the lock if the
+    holder dies.
+    '''
+    f = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class Job:
+    '''
+    Background task tracked by id. Subclasses add their own progress state
+    and run the work in `run`.
+    '''
+    kind = "job"
+
+    def __init__(self, project_id, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.project_id = project_id
+        self.status = PENDING
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.task = None
+        self.events = EventChannel()
+        self.project_events = None
+
+    async def run(self):
+        raise NotImplementedError
+
+    def publish(self, event):
+        event["jobId"] = self.id
+        self.events.publish(event)
+        if self.project_events is not None:
+            self.project_events.publish(event)
+
+    def publish_status(self):
+        self.publish({"type": "status", "status": self.status, "error": self.error})
+
+    async def _run(self):
+        self.status = RUNNING
+        self.publish_status()
+        try:
+            await self.run()
+            self.status = COMPLETED
+        except asyncio.CancelledError:
+            self.status = CANCELLED
+        except Exception as e:
+            print(e)
+            self.status = FAILED
+            self.error = str(e)
+        finally:
+            self.finished = time.time()
+            self.publish_status()
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._run())
+        return self
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "kind": self.kind,
+            "projectId": self.project_id,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class JobRegistry:
+    def __init__(self, ttl=JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._jobs = {}
+        self._project_channels = {}
+
+    def project_channel(self, project_id):
+        '''Channel carrying the events of every job in a project.'''
+        if project_id not in self._project_channels:
+            self._project_channels[project_id] = EventChannel()
+        return self._project_channels[project_id]
+
+    def add(self, job):
+        self.prune()
+        job.project_events = self.project_channel(job.project_id)
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, project_id, job_id, kind=None):
+        job = self._jobs.get(job_id)
+        if job is None or job.project_id != project_id or (kind is not None and job.kind != kind):
+            return None
+        return job
+
+    def prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished is not None and now - job.finished > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class GridJob(Job):
+    '''
+    Computes dispersion grids for a batch of records. `compute` is an async
+    callable taking an `on_record(index, grid)` callback; records are
+    reported as they finish so clients can poll partial results.
+    '''
+    kind = "grids"
+
+    def __init__(self, project_id, names, compute, on_complete=None, cleanup=None):
+        super().__init__(project_id)
+        self.names = names
+        self.grids = [None] * len(names)
+        self.completed_order = []
+        self._compute = compute
+        self._on_complete = on_complete
+        self._cleanup = cleanup
+
+    def record_done(self, index, grid):
+        if self.grids[index] is None:
+            self.completed_order.append(index)
+        self.grids[index] = grid
+        self.publish(self.record_event(index))
+
+    def record_event(self, index):
+        return {
+            "type": "record",
+            "jobId": self.id,
+            "index": index,
+            "name": self.names[index],
+            "grid": self.grids[index],
+        }
+
+    async def run(self):
+        try:
+            await self._compute(self.record_done)
+            if self._on_complete is not None:
+                # Completion hooks write to the project store, which blocks
+                await asyncio.to_thread(self._on_complete, self)
+        finally:
+            if self._cleanup is not None:
+                self._cleanup()
+
+    def record_status(self, index):
+        if self.grids[index] is not None:
+            return COMPLETED
+        if self.status == RUNNING:
+            return RUNNING
+        return self.status
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["total"] = len(self.names)
+        data["completed"] = len(self.completed_order)
+        data["records"] = [
+            {"index": i, "name": name, "status": self.record_status(i)}
+            for i, name in enumerate(self.names)
+        ]
+        return data
+
+
+class InversionJob(Job):
+    '''
+    Runs a global search generation by generation. `step` is an async
+    callable evaluating one generation of the search. After every
+    `checkpoint_every` generations the job is handed to `checkpoint`, so
+    a job interrupted by a restart can be recreated from its state with
+    the same id; `discard_checkpoint` is called with the job once it has
+    finished or been cancelled. `lock`, if set, is an open lock file (see
+    lock_file) claiming the checkpoint for this process; it is closed when
+    the job ends. Progress events carry the best model so far.
+    '''
+    kind = "inversion"
+
+    def __init__(
+            self,
+            project_id,
+            search,
+            step,
+            checkpoint,
+            checkpoint_every=1,
+            discard_checkpoint=None,
+            on_complete=None,
+            result_options=None,
+            job_id=None,
+    ):
+        super().__init__(project_id, job_id)
+        self.search = search
+        self.result = None
+        self.resumed = search.generation > 0
+        self._step = step
+        self._checkpoint = checkpoint
+        self._checkpoint_every = max(1, checkpoint_every)
+        self._discard_checkpoint = discard_checkpoint
+        self._on_complete = on_complete
+        self._result_options = result_options or {}
+        self._cancelled = False
+        self.lock = None
+
+    def progress(self):
+        search = self.search
+        return {
+            "generation": search.generation,
+            "maxGenerations": search.max_generations,
+            "evaluated": len(search.misfits),
+            "bestMisfit": search.best_misfit,
+            "layers": search.best_layers(),
+        }
+
+    def progress_event(self):
+        return {"type": "progress", "jobId": self.id, **self.progress()}
+
+    async def run(self):
+        interrupted = False
+        try:
+            while not self.search.done:
+                await self._step(self.search)
+                self.publish(self.progress_event())
+                if self.search.generation % self._checkpoint_every == 0:
+                    self._checkpoint(self)
+            self.result = self.search.result(**self._result_options)
+            if self._on_complete is not None:
+                await asyncio.to_thread(self._on_complete, self)
+        except asyncio.CancelledError:
+            # Keep the checkpoint when interrupted, e.g. by a shutdown,
+            # rather than cancelled by a client
+            interrupted = not self._cancelled
+            raise
+        finally:
+            if not interrupted and self._discard_checkpoint is not None:
+                self._discard_checkpoint(self)
+            if self.lock is not None:
+                self.lock.close()
+
+    def cancel(self):
+        self._cancelled = True
+        super().cancel()
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["resumed"] = self.resumed
+        data["progress"] = self.progress()
+        if self.result is not None:
+            data["result"] = self.result
+        return data
@@ -1,28 +1,69 @@
-import io
+import asyncio
+import functools
+import hashlib
 import logging
+import math
 import os
 import tempfile
-from time import sleep
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from typing import List, Annotated
 
 import aiofiles
-import aiofiles.os as aios
 import numpy as np
 
-from fastapi import FastAPI, BackgroundTasks, HTTPException, UploadFile, File, Request, status, Form, Depends, Query
+from fastapi import FastAPI, BackgroundTasks, HTTPException, UploadFile, File, Request, status, Form, Query
+from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from starlette.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, PlainTextResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.responses import FileResponse, StreamingResponse
 
-from utils import close_and_remove_file, get_sheets_from_excel, get_geometry_from_sgy
+from utils import get_sheets_from_excel, get_geometry_from_sgy, get_upload_buffer, release_upload_buffer
 from utils import get_geometry_from_excel
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, Union
+from cache import DiskResultCache, LRUByteCache, hash_arrays
+from jobs import JobRegistry, GridJob, InversionJob, lock_file
+from storage import Project, VersionConflict, create_project_store
+from transport import wants_binary, grids_response, npy_response, quote_etag, parse_etags, etag_matches
+from transport import sse_event, grid_sse_event, grid_event_metadata, grid_binary_frame
+from picks import PICK_DTYPE, empty_picks, as_pick_array, picks_from_records, picks_to_records
+from picks import parse_pck_text, parse_pck_binary, format_pck_text
+from autopick import autopick_grid, combine_picks, DEFAULT_MIN_CONTRAST
+from velmodel import curve_from_layers, model_from_layers, phase_velocities, curve_axis_from_settings, curve_key
+from velmodel import PHASE_VEL_DELTA, MAX_CURVE_PERIODS
+from inversion import invert_layers, model_misfits, search_bounds, GlobalSearch, DEFAULT_MAX_ITERATIONS
+from inversion import check_models, misfits_for_picks, save_checkpoint, load_checkpoint
+from inversion import DEFAULT_SAMPLES_PER_GENERATION, DEFAULT_MAX_GENERATIONS, DEFAULT_RESAMPLED_MODELS
+from inversion import DEFAULT_ENSEMBLE_SIZE, DEFAULT_BEST_MODELS, DEFAULT_PATIENCE
+from dispersion import get_freq_axis, get_slow_axis, get_offsets_from_geometry, compute_grid_from_sgy
+from dispersion import set_steering_cache_share
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, Union
 import json
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''Resume interrupted inversion jobs on startup; release the worker pool and project store on shutdown.'''
+    await resume_inversion_jobs()
+    yield
+    shutdown_process_pool()
+    close_project_store()
+
+
+app = FastAPI(lifespan=lifespan)
 CHUNK_SIZE = 1024 * 1024  # adjust the chunk size as desired
+# Processed grids are cached on disk by file contents and processing parameters
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "result_cache")
+RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# SGY uploads up to this size stay in memory and are parsed in place; larger ones spool to disk
+UPLOAD_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+class SgyUploadParser(MultiPartParser):
+    # Only /extractSgyGeom uses the larger spool; other uploads keep Starlette's default
+    spool_max_size = UPLOAD_SPOOL_MAX_SIZE
 
 origins = [
     "http://localhost:*",
@@ -35,6 +76,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["ETag", "X-Grid-Name"],
 )
 
 # data models
@@ -96,6 +138,25 @@ class PickData(BaseModel):
     slowness: float
     d4: float
     d5: float
+class DisperCurveRequest(BaseModel):
+    layers: List[Layer]
+    periods: List[float] = Field(..., max_length=MAX_CURVE_PERIODS)
+    minVelocity: float
+    maxVelocity: float
+    velocityDelta: float = PHASE_VEL_DELTA
+class PickMove(BaseModel):
+    id: int
+    d1: Optional[float] = None
+    d2: Optional[float] = None
+    frequency: Optional[float] = None
+    d3: Optional[float] = None
+    slowness: Optional[float] = None
+    d4: Optional[float] = None
+    d5: Optional[float] = None
+class PicksDelta(BaseModel):
+    add: List[PickData] = []
+    remove: List[int] = []
+    move: List[PickMove] = []
 class Grid(BaseModel):
     name: str
     data: list
@@ -106,13 +167,106 @@ class OptionsModel(BaseModel):
     records: List[RecordOption]
     plotLimits: PlotLimits
 
-# In-memory storage (in a real app, use a database)
-project_data = {}
+class AutoPickParams(BaseModel):
+    minFrequency: Optional[float] = None
+    maxFrequency: Optional[float] = None
+    maxJump: Optional[float] = None  # slowness units
+    minContrast: float = DEFAULT_MIN_CONTRAST  # see autopick.pick_contrast
+
+class BatchAutoPickParams(AutoPickParams):
+    save: bool = False  # Replace the project's picks with the combined curve
+class InversionParams(BaseModel):
+    fitThickness: bool = True
+    maxIterations: int = DEFAULT_MAX_ITERATIONS
+    save: bool = False  # Replace the stored layers with the fitted ones
+class MisfitRequest(BaseModel):
+    # (n_models, n_layers); the last layer is the half-space
+    thicknesses: List[List[float]]
+    velocities: List[List[float]]
+    densities: Optional[List[List[float]]] = None
+# Misfit evaluation: models per worker task, and models per request
+MISFIT_BATCH_MODELS = 250
+MAX_MISFIT_MODELS = 10000
+# Generations per global search, which evaluates up to
+# MAX_MISFIT_MODELS models in each
+MAX_GENERATIONS = 1000
+
+class GlobalSearchParams(BaseModel):
+    velocityBounds: Optional[List[List[float]]] = None  # (min, max) per layer
+    thicknessBounds: Optional[List[List[float]]] = None  # (min, max) per layer above the half-space
+    samplesPerGeneration: int = Field(DEFAULT_SAMPLES_PER_GENERATION, ge=1, le=MAX_MISFIT_MODELS)
+    maxGenerations: int = Field(DEFAULT_MAX_GENERATIONS, ge=1, le=MAX_GENERATIONS)
+    resampledModels: int = Field(DEFAULT_RESAMPLED_MODELS, ge=1, le=MAX_MISFIT_MODELS)
+    # Bands are taken over the ensembleSize best models, all of them returned
+    ensembleSize: int = Field(DEFAULT_ENSEMBLE_SIZE, ge=1, le=MAX_MISFIT_MODELS)
+    bestModels: int = Field(DEFAULT_BEST_MODELS, ge=1, le=MAX_MISFIT_MODELS)
+    patience: int = Field(DEFAULT_PATIENCE, ge=1, le=MAX_GENERATIONS)
+    seed: Optional[int] = None
+    save: bool = False  # Replace the stored layers with the best model
+
+    @model_validator(mode="after")
+    def check_ensemble_size(self):
+        if self.ensembleSize > self.bestModels:
+            raise ValueError("ensembleSize must not exceed bestModels.")
+        return self
+class GlobalSearchJobParams(GlobalSearchParams):
+    checkpointEvery: int = Field(1, ge=1, le=MAX_GENERATIONS)  # generations
+
+# Worker pool for CPU-bound record processing, created on first use
+PROCESS_POOL_WORKERS = os.cpu_count() or 1
+process_pool = None
+
+
+def get_process_pool():
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(
+            max_workers=PROCESS_POOL_WORKERS,
+            initializer=set_steering_cache_share,
+            initargs=(PROCESS_POOL_WORKERS,),
+        )
+    return process_pool
+
+
+def shutdown_process_pool():
+    if process_pool is not None:
+        process_pool.shutdown(wait=False, cancel_futures=True)
+
+result_cache = DiskResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+
+# Background processing jobs, by id
+jobs = JobRegistry()
+# Inversion job checkpoints, one .npz per unfinished job, resumed on startup
+INVERSION_CHECKPOINT_DIR = os.environ.get("INVERSION_CHECKPOINT_DIR", "inversion_checkpoints")
+
+# Project storage, selected with PROJECT_STORE ("sqlite" or "memory").
+# Grids of recently used projects are kept in memory up to PROJECT_CACHE_MAX_BYTES.
+PROJECT_CACHE_MAX_BYTES = int(os.environ.get("PROJECT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+project_store = create_project_store(
+    os.environ.get("PROJECT_STORE", "sqlite"),
+    os.environ.get("PROJECT_DATA_DIR", "project_data"),
+    PROJECT_CACHE_MAX_BYTES,
+)
+
+
+def close_project_store():
+    project_store.close()
+
+# Sections behind each versioned project resource
+GRIDS_SECTIONS = ["freq", "slow", "grids"]
+OPTIONS_SECTIONS = ["geometry", "records", "plotLimits"]
+PICKS_SECTIONS = ["picks"]
+DISPER_SETTINGS_SECTIONS = ["disperSettings"]
+# Binary and JSON bodies of the same resource need distinct etags
+BINARY_ETAG_SUFFIX = "-npy"
+# Forward curves by curve_key, so revisited layer models are not recomputed
+CURVE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+curve_cache = LRUByteCache(CURVE_CACHE_MAX_BYTES)
 
 # Initialize project data structure if it doesn't exist
 def init_project(project_id: str):
-    if project_id not in project_data:
-        project_data[project_id] = {
+    if not project_store.has_project(project_id):
+        project_store.create_project(project_id, {
             "geometry": [],
             "records":[],
             "plotLimits": {
@@ -123,8 +277,7 @@ def init_project(project_id: str):
             },
             "freq":[],
             "slow":[],
-            "grids":[],
-            "picks":[],
+            "picks": empty_picks(),
             "disperSettings": {
                 "layers": [
                     { "startDepth": 0.0, "endDepth": 30.0, "velocity": 760.0, "density": 2.0, "ignore": 0 },
@@ -152,12 +305,11 @@ def init_project(project_id: str):
                 "periodReversed": False,
                 "axesSwapped": False
             }
-        }
-    return project_data[project_id]
+        })
+    return Project(project_store, project_id)
 
 dummy_freq_data = np.load("small_freq_0.npy")
 dummy_slow_data = np.load("small_slow_0.npy")
-dummy_grid_data = np.load("small_grid_0.npy")
 
 
 @app.exception_handler(RequestValidationError)
@@ -173,29 +325,27 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return result_cache.stats()
+
+
+def check_file_extension(file_name: str):
+    split = file_name.split('.')
+    if len(split) <= 1:
+        raise HTTPException(400, "No file extension found.")
+    return "." + split[-1]
+
+
 @app.post("/extractExcel")
 async def get_elevation_from_excel_endpoint(
-        background_tasks: BackgroundTasks,
         excel_file: UploadFile = File(...),
 ):
-    file_name = excel_file.filename
-    split = file_name.split('.')
-    if len(split) <= 1:
-        raise HTTPException(400, "No file extension found.")
-    extension = "." + file_name.split('.')[-1]
+    check_file_extension(excel_file.filename)
     try:
-        fd, path = tempfile.mkstemp(suffix=extension)
-        async with aiofiles.open(path, 'wb') as f:
-            while chunk := await excel_file.read(CHUNK_SIZE):
-                await f.write(chunk)
-            os.close(fd)
-            await f.flush()
-            await f.close()
-        with open(path, 'rb') as f:
-            buffer = io.BytesIO(f.read())
-            geometry_list = get_geometry_from_excel(buffer)
-        background_tasks.add_task(close_and_remove_file(path))
-
+        # Parse straight from the upload spool rather than a copy on disk
+        excel_file.file.seek(0)
+        geometry_list = get_geometry_from_excel(excel_file.file)
     except Exception as e:
         print(e)
         raise HTTPException(400, "Failed to parse excel file.")
@@ -204,27 +354,12 @@ async def get_elevation_from_excel_endpoint(
 
 @app.post("/extractExcelSheets")
 async def get_sheets_from_excel_endpoint(
-        background_tasks: BackgroundTasks,
         excel_file: UploadFile = File(...),
 ):
-    file_name = excel_file.filename
-    split = file_name.split('.')
-    if len(split) <= 1:
-        raise HTTPException(400, "No file extension found.")
-    extension = "." + file_name.split('.')[-1]
+    check_file_extension(excel_file.filename)
     try:
-        fd, path = tempfile.mkstemp(suffix=extension)
-        async with aiofiles.open(path, 'wb') as f:
-            while chunk := await excel_file.read(CHUNK_SIZE):
-                await f.write(chunk)
-            os.close(fd)
-            await f.flush()
-            await f.close()
-        with open(path, 'rb') as f:
-            buffer = io.BytesIO(f.read())
-            sheets_list = get_sheets_from_excel(buffer)
-        background_tasks.add_task(close_and_remove_file(path))
-
+        excel_file.file.seek(0)
+        sheets_list = get_sheets_from_excel(excel_file.file)
     except Exception as e:
         print(e)
         raise HTTPException(400, "Failed to parse excel file.")
@@ -232,37 +367,212 @@ async def get_sheets_from_excel_endpoint(
 
 
 @app.post("/extractSgyGeom")
-async def get_geometry_from_sgy_endpoint(
-        background_tasks: BackgroundTasks,
-        sgy_file: UploadFile = File(...),
-):
-    file_name = sgy_file.filename
-    split = file_name.split('.')
-    if len(split) <= 1:
-        raise HTTPException(400, "No file extension found.")
-    extension = "." + file_name.split('.')[-1]
+async def get_geometry_from_sgy_endpoint(request: Request):
+    '''
+    Geometry from the trace headers of an uploaded SGY file, sent as the
+    multipart field sgy_file. The form is parsed here with SgyUploadParser
+    so that the upload can stay in memory.
+    '''
     try:
-        fd, path = tempfile.mkstemp(suffix=extension)
-        async with aiofiles.open(path, 'wb') as f:
-            while chunk := await sgy_file.read(CHUNK_SIZE):
-                await f.write(chunk)
-            os.close(fd)
-            await f.flush()
-            await f.close()
-        geometry = get_geometry_from_sgy(path)
-        background_tasks.add_task(close_and_remove_file(path))
-
-    except Exception as e:
-        print("Exception")
+        form = await SgyUploadParser(request.headers, request.stream()).parse()
+    except MultiPartException as e:
         print(e)
+        raise HTTPException(400, "Invalid multipart data.")
+    try:
+        sgy_file = form.get("sgy_file")
+        if not isinstance(sgy_file, StarletteUploadFile):
+            raise HTTPException(400, "No sgy file provided.")
+        check_file_extension(sgy_file.filename)
+        geometry = None
+        buffer = get_upload_buffer(sgy_file.file)
+        try:
+            geometry = get_geometry_from_sgy(buffer)
+        except Exception as e:
+            print("Exception")
+            print(e)
+        finally:
+            # Once the exception and its frames are gone, nothing else holds the view
+            release_upload_buffer(buffer)
+    finally:
+        await form.close()
+    if geometry is None:
         raise HTTPException(400, "Failed to parse sgy file.")
     return geometry
 
 #grids endpoint
+def parse_geometry_data(geometry_data: str):
+    try:
+        geometry = [GeometryItem(**item).dict() for item in json.loads(geometry_data)]
+    except Exception as e:
+        print(e)
+        raise HTTPException(400, "Failed to parse geometry data.")
+    if len(geometry) == 0:
+        raise HTTPException(400, "No geometry data provided.")
+    return geometry
+
+
+def validate_grid_params(max_slowness, max_frequency, num_slow_points, num_freq_points):
+    if max_slowness <= 0 or max_frequency <= 0:
+        raise HTTPException(400, "Maximum slowness and frequency must be positive.")
+    if num_slow_points < 2 or num_freq_points < 2:
+        raise HTTPException(400, "At least two slowness and frequency points are required.")
+
+
+async def save_upload_to_tempfile(upload: UploadFile):
+    '''
+    Copy an upload to a temporary file for the worker processes.
+    Returns the path and the SHA-256 digest of the contents.
+    '''
+    extension = check_file_extension(upload.filename)
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(suffix=extension)
+    async with aiofiles.open(path, 'wb') as f:
+        while chunk := await upload.read(CHUNK_SIZE):
+            digest.update(chunk)
+            await f.write(chunk)
+        os.close(fd)
+        await f.flush()
+    return path, digest.hexdigest()
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def save_uploads_to_tempfiles(uploads):
+    paths, digests = [], []
+    try:
+        for upload in uploads:
+            path, digest = await save_upload_to_tempfile(upload)
+            paths.append(path)
+            digests.append(digest)
+    except BaseException:
+        remove_files(paths)
+        raise
+    return paths, digests
+
+
+async def compute_grids(paths, digests, offsets, freq, slow, on_record=None):
+    '''
+    Dispersion grids for the given record files, in order. Results are
+    looked up in the result cache first; each distinct uncached record is
+    processed once in the process pool and the grids are collected as the
+    workers finish. `on_record(index, grid)` is called as each record is ready.
+    '''
+    params_digest = hash_arrays(offsets, freq, slow)
+    grids = [None] * len(paths)
+    pending = {}
+    for i, digest in enumerate(digests):
+        key = result_cache.make_key(digest, params_digest)
+        if key in pending:
+            pending[key].append(i)
+            continue
+        cached = result_cache.get(key)
+        if cached is not None:
+            grids[i] = cached
+            if on_record is not None:
+                on_record(i, cached)
+        else:
+            pending[key] = [i]
+
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+
+    async def process_record(key, path):
+        return key, await loop.run_in_executor(pool, compute_grid_from_sgy, path, offsets, freq, slow)
+
+    tasks = [asyncio.ensure_future(process_record(key, paths[indices[0]])) for key, indices in pending.items()]
+    for next_done in asyncio.as_completed(tasks):
+        try:
+            key, grid = await next_done
+        except BaseException:
+            # Also reached when the caller is cancelled; drop queued work
+            for task in tasks:
+                task.cancel()
+            raise
+        result_cache.put(key, grid)
+        for i in pending[key]:
+            grids[i] = grid
+            if on_record is not None:
+                on_record(i, grid)
+    return grids
+
+
+def grids_payload(grids, freq=None, slow=None):
+    data = {
+        "grids": [
+            {
+                "name": grid["name"],
+                "data": grid["data"].tolist(),
+                "shape": list(grid["data"].shape)
+            } for grid in grids
+        ]
+    }
+    if freq is not None:
+        data["freq"] = {"data": np.asarray(freq).tolist()}
+    if slow is not None:
+        data["slow"] = {"data": np.asarray(slow).tolist()}
+    return {"data": data}
+
+
+def resource_etag(project, names, binary=False):
+    etag = project.etag(names)
+    return etag + BINARY_ETAG_SUFFIX if binary else etag
+
+
+def not_modified_response(request: Request, etag):
+    '''304 response when If-None-Match already names the current version.'''
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": quote_etag(etag)})
+    return None
+
+
+def if_match_etags(request: Request):
+    '''Etags from If-Match, or None when there is no precondition to check.'''
+    header = request.headers.get("if-match")
+    if header is None or header.strip() == "*":
+        return None
+    return {
+        tag[:-len(BINARY_ETAG_SUFFIX)] if tag.endswith(BINARY_ETAG_SUFFIX) else tag
+        for tag in parse_etags(header)
+    }
+
+
+def check_if_match(request: Request, project, names):
+    '''Fail early, before any expensive work, if If-Match is already stale.'''
+    etags = if_match_etags(request)
+    if etags is not None and project.etag(names) not in etags:
+        raise HTTPException(412, "Project data has been modified.")
+
+
+def update_project(request: Request, project, values):
+    '''Write the sections of one resource, honoring If-Match. Returns the new etag.'''
+    try:
+        project.update(values, if_match_etags(request))
+    except VersionConflict:
+        raise HTTPException(412, "Project data has been modified.")
+    return project.etag(list(values))
+
+
+def load_project(project_id: str, names):
+    '''
+    init_project plus the named sections. Store calls block on disk and on
+    the database lock, so async handlers run this with asyncio.to_thread;
+    endpoints that only touch the store are plain def and run in the
+    threadpool.
+    '''
+    project = init_project(project_id)
+    return project, [project[name] for name in names]
+
+
 @app.post("/project/{project_id}/grids")
 async def dummy_grids_save(
         project_id:str,
-        background_tasks: BackgroundTasks,
+        request: Request,
         sgy_files: Annotated[list[UploadFile], File(...)],
         geometry_data: Annotated[str, Form(...)],  # Format as json
         max_slowness: Annotated[float, Form(...)],
@@ -270,122 +580,337 @@ async def dummy_grids_save(
         num_slow_points: Annotated[int, Form(...)],
         num_freq_points: Annotated[int, Form(...)],
         return_freq_and_slow: Annotated[bool, Form(...)] = True,
+        response_format: Annotated[Optional[str], Query(alias="format")] = None,
 ):
-    # if return_freq_and_slow:
-    #     kwargs_savez = {
-    #         "freq": dummy_freq_data,
-    #         "slow": dummy_slow_data,
-    #     }
-    # else:
-    #     kwargs_savez = {}
-
-    # # When actually implemented, generate grids for them here
-    # for i, _ in enumerate(sgy_files):
-    #     kwargs_savez["grid_" + str(i)] = dummy_grid_data
-
-    # # A couple thoughts on how to return this
-    # # - As an npz, saved as a temporary file. Either uncompressed or compressed
-    # # - As 1 or more npy files zipped together
-    # # - As json data
-
-    # return "No return yet"
-    # Prepare response data
-    response_data = {
-        "data": {
-            "grids": []
-        }
-    }
-    
-    # Add frequency and slowness data if requested
-    if return_freq_and_slow:
-        response_data["data"]["freq"] = {
-            "data": dummy_freq_data.tolist(),
-        }
-        response_data["data"]["slow"] = {
-            "data": dummy_slow_data.tolist(),
-        }
-        
-        project_data[project_id]["freq"] = response_data["data"]["freq"]
-        project_data[project_id]["slow"] = response_data["data"]["slow"]
-    
-    # Add grid data for each sgy file as array elements
-    for i, sgy_file in enumerate(sgy_files):
-        response_data["data"]["grids"].append({
-            "name": sgy_file.filename,
-            "data": dummy_grid_data.tolist(),
-            "shape": dummy_grid_data.shape
+    project = await asyncio.to_thread(init_project, project_id)
+    await asyncio.to_thread(check_if_match, request, project, GRIDS_SECTIONS)
+    geometry = parse_geometry_data(geometry_data)
+    validate_grid_params(max_slowness, max_frequency, num_slow_points, num_freq_points)
+    offsets = get_offsets_from_geometry(geometry)
+    freq = get_freq_axis(max_frequency, num_freq_points)
+    slow = get_slow_axis(max_slowness, num_slow_points)
+
+    paths, digests = await save_uploads_to_tempfiles(sgy_files)
+    try:
+        results = await compute_grids(paths, digests, offsets, freq, slow)
+    except Exception as e:
+        print(e)
+        raise HTTPException(400, "Failed to process sgy files.")
+    finally:
+        remove_files(paths)
+    grids = [
+        {"name": sgy_file.filename, "data": grid}
+        for sgy_file, grid in zip(sgy_files, results)
+    ]
+
+    etag = await asyncio.to_thread(update_project, request, project, {
+        "freq": freq.tolist(),
+        "slow": slow.tolist(),
+        "grids": grids,
+    })
+
+    if not return_freq_and_slow:
+        freq = slow = None
+    if wants_binary(request, response_format):
+        response = grids_response(grids, freq, slow)
+        response.headers["ETag"] = quote_etag(etag + BINARY_ETAG_SUFFIX)
+        return response
+    return JSONResponse(grids_payload(grids, freq, slow), headers={"ETag": quote_etag(etag)})
+
+#grid job endpoints
+@app.post("/project/{project_id}/grids/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_grids_job(
+        project_id: str,
+        sgy_files: Annotated[list[UploadFile], File(...)],
+        geometry_data: Annotated[str, Form(...)],  # Format as json
+        max_slowness: Annotated[float, Form(...)],
+        max_frequency: Annotated[float, Form(...)],
+        num_slow_points: Annotated[int, Form(...)],
+        num_freq_points: Annotated[int, Form(...)],
+):
+    project = await asyncio.to_thread(init_project, project_id)
+    geometry = parse_geometry_data(geometry_data)
+    validate_grid_params(max_slowness, max_frequency, num_slow_points, num_freq_points)
+    offsets = get_offsets_from_geometry(geometry)
+    freq = get_freq_axis(max_frequency, num_freq_points)
+    slow = get_slow_axis(max_slowness, num_slow_points)
+
+    paths, digests = await save_uploads_to_tempfiles(sgy_files)
+
+    def compute(on_record):
+        return compute_grids(paths, digests, offsets, freq, slow, on_record=on_record)
+
+    def on_complete(job):
+        project.update({
+            "freq": freq.tolist(),
+            "slow": slow.tolist(),
+            "grids": [
+                {"name": name, "data": grid}
+                for name, grid in zip(job.names, job.grids)
+            ],
         })
-        
-    project_data[project_id]["grids"] = response_data["data"]["grids"]
-    
+
+    def cleanup():
+        remove_files(paths)
+
+    names = [sgy_file.filename for sgy_file in sgy_files]
+    job = jobs.add(GridJob(project_id, names, compute, on_complete=on_complete, cleanup=cleanup)).start()
+    return job.to_dict()
+
+
+def get_grids_job_or_404(project_id: str, job_id: str):
+    job = jobs.get(project_id, job_id, kind=GridJob.kind)
+    if job is None:
+        raise HTTPException(404, "Job not found.")
+    return job
+
+
+@app.get("/project/{project_id}/grids/jobs/{job_id}")
+async def get_grids_job(
+        project_id: str,
+        job_id: str,
+        offset: int = 0,
+        include_grids: bool = True,
+):
+    """
+    Job progress plus, when include_grids is set, the grids of records that
+    finished after the first `offset` completions (in completion order), so
+    pollers only receive new records.
+    """
+    job = get_grids_job_or_404(project_id, job_id)
+    response_data = job.to_dict()
+    if include_grids:
+        response_data["grids"] = [
+            {
+                "index": i,
+                "name": job.names[i],
+                "data": job.grids[i].tolist(),
+                "shape": list(job.grids[i].shape)
+            } for i in job.completed_order[offset:]
+        ]
     return response_data
 
-@app.get("/project/{project_id}/grids")
-async def dummy_grids_get(project_id: str, return_freq_and_slow = True):
+
+@app.delete("/project/{project_id}/grids/jobs/{job_id}")
+async def cancel_grids_job(project_id: str, job_id: str):
+    job = get_grids_job_or_404(project_id, job_id)
+    job.cancel()
+    return job.to_dict()
+
+
+@app.get("/project/{project_id}/grids/jobs/{job_id}/events")
+async def stream_grids_job(project_id: str, job_id: str):
+    """
+    Server-sent events for a grid job: a "record" event per finished record
+    (including those finished before connecting) and "status" events, ending
+    once the job has finished.
+    """
+    job = get_grids_job_or_404(project_id, job_id)
+
+    async def event_stream():
+        queue = job.events.subscribe()
+        try:
+            sent = set()
+            for index in list(job.completed_order):
+                sent.add(index)
+                yield grid_sse_event(job.record_event(index))
+            yield sse_event("status", job.to_dict())
+            while not (job.done and queue.empty()):
+                event = await queue.get()
+                if event["type"] == "record":
+                    if event["index"] in sent:
+                        continue
+                    sent.add(event["index"])
+                    yield grid_sse_event(event)
+                else:
+                    yield sse_event("status", job.to_dict())
+        finally:
+            job.events.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/project/{project_id}/ws")
+async def project_channel(websocket: WebSocket, project_id: str):
+    """
+    Project channel carrying the events of every job in the project. Record
+    events are sent as a JSON text frame with the metadata followed by a
+    binary frame holding the little-endian float32 grid.
+    """
+    await websocket.accept()
+    channel = jobs.project_channel(project_id)
+    queue = channel.subscribe()
+    try:
+        while True:
+            event = await queue.get()
+            if event["type"] == "record":
+                await websocket.send_json(grid_event_metadata(event))
+                await websocket.send_bytes(grid_binary_frame(event))
+            else:
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        channel.unsubscribe(queue)
+
+
+@app.post("/project/{project_id}/grids/{record_index}/autopick")
+def autopick_record(project_id: str, record_index: int, params: Optional[AutoPickParams] = None):
+    '''Automatic picks along the dispersion ridge of one stored grid.'''
+    params = params or AutoPickParams()
     project = init_project(project_id)
-    response_data = {
-        "data": {
-            "grids": project["grids"]
-        }
+    grids = project["grids"]
+    if not 0 <= record_index < len(grids):
+        raise HTTPException(404, "Grid not found.")
+    try:
+        picks = autopick_grid(
+            grids[record_index]["data"],
+            project["freq"],
+            project["slow"],
+            min_frequency=params.minFrequency,
+            max_frequency=params.maxFrequency,
+            max_jump=params.maxJump,
+            min_contrast=params.minContrast,
+        )
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Failed to pick grid.")
+    return {"data": {"name": grids[record_index]["name"], "picks": picks_to_records(picks)}}
+
+def match_records_to_grids(records, grids):
+    '''
+    Record options for each grid, matched on file name. Grids without a
+    record are treated as enabled with weight 1.
+    '''
+    by_name = {record["fileName"]: record for record in records}
+    return [
+        by_name.get(grid["name"], {"id": grid["name"], "enabled": True, "weight": 1.0, "fileName": grid["name"]})
+        for grid in grids
+    ]
+
+@app.post("/project/{project_id}/autopick")
+async def autopick_project(project_id: str, request: Request, params: Optional[BatchAutoPickParams] = None):
+    '''
+    Auto-pick every enabled record in parallel worker processes and combine
+    the picks into one curve weighted by the record weights.
+    '''
+    params = params or BatchAutoPickParams()
+    project, (grids, freq, slow, records) = await asyncio.to_thread(
+        load_project, project_id, ["grids", "freq", "slow", "records"]
+    )
+    if params.save:
+        await asyncio.to_thread(check_if_match, request, project, PICKS_SECTIONS)
+    freq = np.asarray(freq)
+    slow = np.asarray(slow)
+    selected = [
+        (grid, record)
+        for grid, record in zip(grids, match_records_to_grids(records, grids))
+        if record["enabled"]
+    ]
+
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    pick_record = functools.partial(
+        autopick_grid,
+        freq=freq,
+        slow=slow,
+        min_frequency=params.minFrequency,
+        max_frequency=params.maxFrequency,
+        max_jump=params.maxJump,
+        min_contrast=params.minContrast,
+    )
+    try:
+        pick_sets = await asyncio.gather(*[
+            loop.run_in_executor(pool, pick_record, np.asarray(grid["data"]))
+            for grid, _ in selected
+        ])
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Failed to pick grids.")
+
+    combined = combine_picks(pick_sets, [record["weight"] for _, record in selected], freq)
+    data = {
+        "records": [
+            {
+                "id": record["id"],
+                "name": grid["name"],
+                "weight": record["weight"],
+                "picks": picks_to_records(picks),
+            } for (grid, record), picks in zip(selected, pick_sets)
+        ],
+        "combined": picks_to_records(combined),
     }
-    
-    # Add frequency and slowness data if requested
-    if return_freq_and_slow:
-        response_data["data"]["freq"] = {
-            "data": project["freq"],
-        }
-        response_data["data"]["slow"] = {
-            "data": project["slow"],
-        }
-    
-    return response_data
+    if not params.save:
+        return {"data": data}
+    etag = await asyncio.to_thread(update_project, request, project, {"picks": combined})
+    return JSONResponse({"data": data}, headers={"ETag": quote_etag(etag)})
+
+@app.get("/project/{project_id}/grids")
+def dummy_grids_get(
+        project_id: str,
+        request: Request,
+        return_freq_and_slow: bool = True,
+        response_format: Annotated[Optional[str], Query(alias="format")] = None,
+):
+    project = init_project(project_id)
+    binary = wants_binary(request, response_format)
+    etag = resource_etag(project, GRIDS_SECTIONS, binary)
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    freq = project["freq"] if return_freq_and_slow else None
+    slow = project["slow"] if return_freq_and_slow else None
+    grids = project["grids"]
+    if binary:
+        response = grids_response(grids, freq, slow)
+        response.headers["ETag"] = quote_etag(etag)
+        return response
+    return JSONResponse(grids_payload(grids, freq, slow), headers={"ETag": quote_etag(etag)})
 
 
 @app.post("/process/grid")
 async def dummy_grid_endpoint(
-        background_tasks: BackgroundTasks,
+        request: Request,
         sgy_file: Annotated[UploadFile, File(...)],
         geometry_data: Annotated[str, Form(...)],  # Format as json
         max_slowness: Annotated[float, Form(...)],
         max_frequency: Annotated[float, Form(...)],
         num_slow_points: Annotated[int, Form(...)],
         num_freq_points: Annotated[int, Form(...)],
+        response_format: Annotated[Optional[str], Query(alias="format")] = None,
 ):
-    # Alternate version - only return a single grid
-    # with tempfile.NamedTemporaryFile(suffix=".npy", delete=False) as temp_file:
-    #     # Get the temporary file path
-    #     temp_file_path = temp_file.name
-
-    #     # Save the NumPy array to the temporary file
-    #     np.save(temp_file_path, dummy_grid_data)
-
-    # #TODO: Properly handle deleting the tempfile using background_tasks
-    # return FileResponse(
-    #     path=temp_file_path,
-    # )
-    # Prepare response data
+    geometry = parse_geometry_data(geometry_data)
+    validate_grid_params(max_slowness, max_frequency, num_slow_points, num_freq_points)
+    offsets = get_offsets_from_geometry(geometry)
+    freq = get_freq_axis(max_frequency, num_freq_points)
+    slow = get_slow_axis(max_slowness, num_slow_points)
+
+    path, digest = await save_upload_to_tempfile(sgy_file)
+    try:
+        grid, = await compute_grids([path], [digest], offsets, freq, slow)
+    except Exception as e:
+        print(e)
+        raise HTTPException(400, "Failed to process sgy file.")
+    finally:
+        remove_files([path])
+
+    if wants_binary(request, response_format):
+        return npy_response(grid, name=sgy_file.filename)
     response_data = {
-        # "metadata": {
-        #     "max_slowness": max_slowness,
-        #     "max_frequency": max_frequency,
-        #     "num_slow_points": num_slow_points,
-        #     "num_freq_points": num_freq_points
-        # },
         "data": {
             "grid": {
                 "name": sgy_file.filename,
-                "data": dummy_grid_data.tolist(),
-                "shape": dummy_grid_data.shape
+                "data": grid.tolist(),
+                "shape": list(grid.shape)
             },
-            # "freq": {
-            #     "data": dummy_freq_data.tolist(),
-            # },
-            # "slow": {
-            #     "data": dummy_slow_data.tolist(),
-            # }
         }
     }
-    
+
     return response_data
 
 @app.post("/process/frequency_with_sgy")
@@ -448,6 +973,34 @@ async def dummy_freq_endpoint_from_sgy(
         path=temp_file_path,
     )
 
+@app.post("/process/disper_curve")
+async def disper_curve_endpoint(curve_request: DisperCurveRequest):
+    '''
+    Theoretical Rayleigh dispersion curve for a layer model, computed for
+    all periods at once. Velocities are null where no root lies in
+    [minVelocity, maxVelocity].
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        velocities = await loop.run_in_executor(
+            get_process_pool(),
+            curve_from_layers,
+            [layer.dict() for layer in curve_request.layers],
+            curve_request.periods,
+            curve_request.minVelocity,
+            curve_request.maxVelocity,
+            curve_request.velocityDelta,
+        )
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Invalid layer model or velocity range.")
+    return {
+        "data": {
+            "periods": curve_request.periods,
+            "velocities": [None if np.isnan(v) else v for v in velocities.tolist()],
+        }
+    }
+
 # Geometry endpoints
 # @app.get("/project/{project_id}/geometry")
 # async def get_geometry(project_id: str):
@@ -474,20 +1027,347 @@ async def dummy_freq_endpoint_from_sgy(
 
 # model endpoints
 @app.get("/project/{project_id}/disper-settings")
-async def get_disper_settings(project_id: str):
+def get_disper_settings(project_id: str, request: Request, response: Response):
     project = init_project(project_id)
+    etag = resource_etag(project, DISPER_SETTINGS_SECTIONS)
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = quote_etag(etag)
     return project["disperSettings"]
 
 @app.post("/project/{project_id}/disper-settings")
-async def save_disper_settings(project_id: str, model: DisperSettingsModel):
+def save_disper_settings(project_id: str, model: DisperSettingsModel, request: Request, response: Response):
     project = init_project(project_id)
-    project["disperSettings"] = model.dict()
+    etag = update_project(request, project, {"disperSettings": model.dict()})
+    response.headers["ETag"] = quote_etag(etag)
     return {"status": "success"}
 
+@app.post("/project/{project_id}/disper-settings/curve")
+async def disper_settings_curve(project_id: str):
+    '''
+    Theoretical curve for the stored layers on the period axis given by
+    curveAxisLimits and numPoints. Curves are memoized by the layer model,
+    periods and velocity range, so returning to an earlier model is a
+    cache lookup.
+    '''
+    _, (settings,) = await asyncio.to_thread(load_project, project_id, ["disperSettings"])
+    try:
+        thickness, vp, vs, rho = model_from_layers(settings["layers"])
+        periods, vel_min, vel_max = curve_axis_from_settings(settings)
+    except (ValueError, KeyError, TypeError) as e:
+        print(e)
+        raise HTTPException(400, "Invalid layer model or curve axis settings.")
+
+    key = curve_key(thickness, vp, vs, rho, periods, vel_min, vel_max)
+    velocities = curve_cache.get(key)
+    if velocities is None:
+        loop = asyncio.get_running_loop()
+        velocities = await loop.run_in_executor(
+            get_process_pool(),
+            phase_velocities,
+            periods, thickness, vp, vs, rho, vel_min, vel_max,
+        )
+        curve_cache.put(key, velocities)
+    return {
+        "data": {
+            "periods": periods.tolist(),
+            "velocities": [None if np.isnan(v) else v for v in velocities.tolist()],
+        }
+    }
+
+@app.post("/project/{project_id}/disper-settings/invert")
+async def invert_disper_settings(project_id: str, request: Request, params: Optional[InversionParams] = None):
+    '''
+    Fit the stored layers to the project's picks by damped least squares,
+    starting from the current model. With save the fitted layers replace
+    the stored ones.
+    '''
+    params = params or InversionParams()
+    project, (settings, picks) = await asyncio.to_thread(load_project, project_id, ["disperSettings", "picks"])
+    if params.save:
+        await asyncio.to_thread(check_if_match, request, project, DISPER_SETTINGS_SECTIONS)
+    picks = as_pick_array(picks)
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(
+            get_process_pool(),
+            functools.partial(
+                invert_layers,
+                settings["layers"],
+                picks,
+                fit_thickness=params.fitThickness,
+                max_iterations=params.maxIterations,
+            ),
+        )
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Invalid layer model or no usable picks.")
+    if not params.save:
+        return {"data": result}
+    etag = await asyncio.to_thread(
+        update_project, request, project, {"disperSettings": {**settings, "layers": result["layers"]}}
+    )
+    return JSONResponse({"data": result}, headers={"ETag": quote_etag(etag)})
+
+def create_global_search(settings, picks, params: GlobalSearchParams):
+    low, high = search_bounds(settings["layers"], params.velocityBounds, params.thicknessBounds)
+    return GlobalSearch.from_picks(
+        settings["layers"],
+        picks,
+        low,
+        high,
+        samples=params.samplesPerGeneration,
+        max_generations=params.maxGenerations,
+        resampled=params.resampledModels,
+        patience=params.patience,
+        seed=params.seed,
+    )
+
+
+async def evaluate_misfits(misfit_function, thickness, vs, rho):
+    '''
+    misfit_function(thickness, vs, rho) of a batch of (n_models, n_layers)
+    models, split across the worker processes in tasks of at most
+    MISFIT_BATCH_MODELS models, and small enough that every worker gets one.
+    '''
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    rho = np.broadcast_to(rho, vs.shape)
+    batch_size = max(1, min(MISFIT_BATCH_MODELS, math.ceil(len(vs) / PROCESS_POOL_WORKERS)))
+    misfits = await asyncio.gather(*[
+        loop.run_in_executor(pool, misfit_function, thickness[batch], vs[batch], rho[batch])
+        for batch in (slice(start, start + batch_size) for start in range(0, len(vs), batch_size))
+    ])
+    return np.concatenate(misfits) if misfits else np.zeros(0)
+
+
+async def run_search_generation(search):
+    thickness, vs = search.candidates()
+    misfit_function = functools.partial(model_misfits, search.periods, search.observed)
+    search.update(await evaluate_misfits(misfit_function, thickness, vs, search.rho))
+
+
+@app.post("/project/{project_id}/disper-settings/misfits")
+async def disper_settings_misfits(
+        project_id: str,
+        models: MisfitRequest,
+        request: Request,
+        response_format: Annotated[Optional[str], Query(alias="format")] = None,
+):
+    '''
+    Velocity RMSE against the project's picks for each of many layer
+    models, given as (n_models, n_layers) arrays. Misfits are returned as
+    JSON, or as a float64 .npy array with ?format=npy.
+    '''
+    if len(models.velocities) > MAX_MISFIT_MODELS:
+        raise HTTPException(400, f"At most {MAX_MISFIT_MODELS} models per request.")
+    _, (picks,) = await asyncio.to_thread(load_project, project_id, ["picks"])
+    try:
+        thickness, vs, rho = check_models(models.thicknesses, models.velocities, models.densities)
+        misfit_function = functools.partial(misfits_for_picks, as_pick_array(picks))
+        misfits = await evaluate_misfits(misfit_function, thickness, vs, rho)
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Invalid layer models or no usable picks.")
+    if wants_binary(request, response_format):
+        return npy_response(misfits, dtype=np.float64)
+    return {"data": {"misfits": misfits.tolist()}}
+
+@app.post("/project/{project_id}/disper-settings/global-search")
+async def global_search_disper_settings(
+        project_id: str,
+        request: Request,
+        params: Optional[GlobalSearchParams] = None,
+):
+    '''
+    Global search for layer models fitting the project's picks within the
+    given bounds, evaluated in parallel across the worker processes.
+    Returns the best models and min / median / max bands over the
+    ensemble of the best ones. With save the best model replaces the
+    stored layers.
+    '''
+    params = params or GlobalSearchParams()
+    project, (settings, picks) = await asyncio.to_thread(load_project, project_id, ["disperSettings", "picks"])
+    if params.save:
+        await asyncio.to_thread(check_if_match, request, project, DISPER_SETTINGS_SECTIONS)
+    try:
+        search = create_global_search(settings, as_pick_array(picks), params)
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Invalid layer model, bounds or no usable picks.")
+
+    while not search.done:
+        await run_search_generation(search)
+    result = search.result(params.bestModels, params.ensembleSize)
+    if not params.save:
+        return {"data": result}
+    etag = await asyncio.to_thread(
+        update_project, request, project, {"disperSettings": {**settings, "layers": result["layers"]}}
+    )
+    return JSONResponse({"data": result}, headers={"ETag": quote_etag(etag)})
+
+def inversion_checkpoint_path(job_id: str):
+    return os.path.join(INVERSION_CHECKPOINT_DIR, f"{job_id}.npz")
+
+
+def inversion_lock_path(job_id: str):
+    return os.path.join(INVERSION_CHECKPOINT_DIR, f"{job_id}.lock")
+
+
+def start_inversion_job(project_id: str, search, options, job_id=None, lock=None):
+    '''
+    Start (or, with the id and claimed lock of an interrupted job, resume)
+    a global search job checkpointed to INVERSION_CHECKPOINT_DIR. The job
+    holds the lock on its checkpoint while it runs, so no other worker
+    resumes it. `options` holds the request settings needed to finish the
+    job and is kept in the checkpoint.
+    '''
+    def checkpoint(job):
+        save_checkpoint(inversion_checkpoint_path(job.id), job.search, {"projectId": project_id, **options})
+
+    def discard_checkpoint(job):
+        remove_files([inversion_checkpoint_path(job.id)])
+        try:
+            os.remove(inversion_lock_path(job.id))
+        except OSError:
+            # Windows cannot remove the lock file while it is held
+            pass
+
+    def on_complete(job):
+        if options["save"]:
+            project = init_project(project_id)
+            project.update({"disperSettings": {**project["disperSettings"], "layers": job.result["layers"]}})
+
+    job = InversionJob(
+        project_id,
+        search,
+        run_search_generation,
+        checkpoint,
+        checkpoint_every=options["checkpointEvery"],
+        discard_checkpoint=discard_checkpoint,
+        on_complete=on_complete,
+        result_options={"best_models": options["bestModels"], "ensemble_size": options["ensembleSize"]},
+        job_id=job_id,
+    )
+    # A new job's id is fresh, so its lock is free
+    job.lock = lock or lock_file(inversion_lock_path(job.id))
+    checkpoint(job)
+    return jobs.add(job).start()
+
+
+async def resume_inversion_jobs():
+    '''
+    Resume the jobs left with a checkpoint. Each checkpoint is claimed with
+    its lock first, so with several workers each job is resumed by exactly
+    one of them, and jobs still running elsewhere are left alone.
+    '''
+    os.makedirs(INVERSION_CHECKPOINT_DIR, exist_ok=True)
+    for file_name in sorted(os.listdir(INVERSION_CHECKPOINT_DIR)):
+        job_id, extension = os.path.splitext(file_name)
+        if extension != ".npz":
+            continue
+        lock = lock_file(inversion_lock_path(job_id))
+        if lock is None:
+            continue
+        try:
+            search, options = load_checkpoint(inversion_checkpoint_path(job_id))
+            project_id = options.pop("projectId")
+            GlobalSearchJobParams(**options)
+        except (OSError, ValueError, KeyError) as e:
+            # Finished since it was listed, or unreadable
+            print(e)
+            lock.close()
+            continue
+        start_inversion_job(project_id, search, options, job_id=job_id, lock=lock)
+
+
+@app.post("/project/{project_id}/disper-settings/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_inversion_job(project_id: str, params: Optional[GlobalSearchJobParams] = None):
+    '''
+    Global search as a background job. The search state is checkpointed
+    to disk every checkpointEvery generations, and jobs interrupted by a
+    restart resume from their last checkpoint under the same id.
+
+    Jobs live in the worker process running them, so their status and
+    events are only served by that worker: run the backend with a single
+    worker when using inversion jobs.
+    '''
+    params = params or GlobalSearchJobParams()
+    _, (settings, picks) = await asyncio.to_thread(load_project, project_id, ["disperSettings", "picks"])
+    try:
+        search = create_global_search(settings, as_pick_array(picks), params)
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Invalid layer model, bounds or no usable picks.")
+    options = {
+        "save": params.save,
+        "checkpointEvery": params.checkpointEvery,
+        "bestModels": params.bestModels,
+        "ensembleSize": params.ensembleSize,
+    }
+    return start_inversion_job(project_id, search, options).to_dict()
+
+
+def get_inversion_job_or_404(project_id: str, job_id: str):
+    job = jobs.get(project_id, job_id, kind=InversionJob.kind)
+    if job is None:
+        raise HTTPException(404, "Job not found.")
+    return job
+
+
+@app.get("/project/{project_id}/disper-settings/jobs/{job_id}")
+async def get_inversion_job(project_id: str, job_id: str):
+    '''Job status and progress, plus the search result once completed.'''
+    return get_inversion_job_or_404(project_id, job_id).to_dict()
+
+
+@app.delete("/project/{project_id}/disper-settings/jobs/{job_id}")
+async def cancel_inversion_job(project_id: str, job_id: str):
+    job = get_inversion_job_or_404(project_id, job_id)
+    job.cancel()
+    return job.to_dict()
+
+
+@app.get("/project/{project_id}/disper-settings/jobs/{job_id}/events")
+async def stream_inversion_job(project_id: str, job_id: str):
+    '''
+    Server-sent events for an inversion job: a "progress" event per
+    generation with the best misfit and model so far, and "status" events,
+    ending once the job has finished. The first event is the current
+    status, so late subscribers start from the latest progress.
+    '''
+    job = get_inversion_job_or_404(project_id, job_id)
+
+    async def event_stream():
+        queue = job.events.subscribe()
+        try:
+            yield sse_event("status", job.to_dict())
+            while not (job.done and queue.empty()):
+                event = await queue.get()
+                if event["type"] == "progress":
+                    yield sse_event("progress", event)
+                else:
+                    yield sse_event("status", job.to_dict())
+        finally:
+            job.events.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 #pick data endpoints
 @app.get("/project/{project_id}/options")
-async def get_options(project_id:str):
+def get_options(project_id:str, request: Request, response: Response):
     project = init_project(project_id)
+    etag = resource_etag(project, OPTIONS_SECTIONS)
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = quote_etag(etag)
     response_data = {}
     response_data["geometry"] = project["geometry"]
     response_data["records"] = project["records"]
@@ -496,21 +1376,107 @@ async def get_options(project_id:str):
     return response_data
 
 @app.post("/project/{project_id}/options")
-async def save_options(project_id: str, options: OptionsModel):
+def save_options(project_id: str, options: OptionsModel, request: Request, response: Response):
     project = init_project(project_id)
-    project["geometry"] = options.geometry
-    project["records"] = options.records
-    project["plotLimits"] = options.plotLimits
+    etag = update_project(request, project, {
+        "geometry": [item.dict() for item in options.geometry],
+        "records": [item.dict() for item in options.records],
+        "plotLimits": options.plotLimits.dict(),
+    })
+    response.headers["ETag"] = quote_etag(etag)
     return {"status": "success"}
 
 #pick data endpoint
 @app.post("/project/{project_id}/picks")
-async def save_picks(project_id: str, picks: List[PickData]):
+def save_picks(project_id: str, picks: List[PickData], request: Request, response: Response):
     project = init_project(project_id)
-    project["picks"] = [item.dict() for item in picks]
+    etag = update_project(request, project, {"picks": picks_from_records([item.dict() for item in picks])})
+    response.headers["ETag"] = quote_etag(etag)
     return {"status": "success", "count": len(picks)}
 
+@app.patch("/project/{project_id}/picks")
+def patch_picks(project_id: str, delta: PicksDelta, request: Request, response: Response):
+    project = init_project(project_id)
+    try:
+        _, ids, count = project.apply_pick_delta(
+            add=picks_from_records([item.dict() for item in delta.add]),
+            remove=delta.remove,
+            move=[(item.id, item.dict(exclude={"id"}, exclude_none=True)) for item in delta.move],
+            expected_etags=if_match_etags(request),
+        )
+    except KeyError as e:
+        print(e)
+        raise HTTPException(400, "Unknown or duplicate pick id.")
+    except VersionConflict:
+        raise HTTPException(412, "Project data has been modified.")
+    response.headers["ETag"] = quote_etag(project.etag(PICKS_SECTIONS))
+    return {"status": "success", "added": ids, "count": count}
+
+@app.post("/project/{project_id}/picks/import")
+async def import_picks(project_id: str, request: Request, response: Response, mode: str = "replace"):
+    '''
+    Bulk import of a raw .pck body. Text bodies are parsed as .pck lines;
+    application/x-npy or application/octet-stream bodies as binary picks.
+    `mode` is "replace" or "append".
+    '''
+    if mode not in ("replace", "append"):
+        raise HTTPException(400, "Import mode must be 'replace' or 'append'.")
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").lower()
+    try:
+        if body.startswith(b"\x93NUMPY") or "octet-stream" in content_type or "x-npy" in content_type:
+            picks = parse_pck_binary(body)
+        else:
+            picks = parse_pck_text(body)
+    except ValueError as e:
+        print(e)
+        raise HTTPException(400, "Invalid pick file.")
+
+    def write_picks():
+        project = init_project(project_id)
+        if mode == "append":
+            # Only the new picks are written, numbered after the existing ones
+            try:
+                _, _, count = project.apply_pick_delta(add=picks, expected_etags=if_match_etags(request))
+            except VersionConflict:
+                raise HTTPException(412, "Project data has been modified.")
+            return project.etag(PICKS_SECTIONS), count
+        return update_project(request, project, {"picks": picks}), len(picks)
+
+    etag, count = await asyncio.to_thread(write_picks)
+    response.headers["ETag"] = quote_etag(etag)
+    return {"status": "success", "count": count}
+
+@app.get("/project/{project_id}/picks/export")
+def export_picks(
+        project_id: str,
+        request: Request,
+        response_format: Annotated[Optional[str], Query(alias="format")] = None,
+):
+    '''Picks as .pck text, or as a structured .npy array with ?format=npy.'''
+    project = init_project(project_id)
+    binary = wants_binary(request, response_format)
+    etag = resource_etag(project, PICKS_SECTIONS, binary)
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    picks = as_pick_array(project["picks"])
+    if binary:
+        response = npy_response(picks, dtype=PICK_DTYPE)
+    else:
+        response = PlainTextResponse(format_pck_text(picks))
+    response.headers["ETag"] = quote_etag(etag)
+    extension = "npy" if binary else "pck"
+    response.headers["Content-Disposition"] = f'attachment; filename="picks.{extension}"'
+    return response
+
 @app.get("/project/{project_id}/picks")
-async def get_picks(project_id:str):
+def get_picks(project_id:str, request: Request, response: Response):
     project = init_project(project_id)
-    return project["picks"]
+    etag = resource_etag(project, PICKS_SECTIONS)
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = quote_etag(etag)
+    return picks_to_records(as_pick_array(project["picks"]))
@@ -0,0 +1,113 @@
+import io
+
+import numpy as np
+
+# Column order of the .pck format
+PICK_FIELDS = ["d1", "d2", "frequency", "d3", "slowness", "d4", "d5"]
+PICK_DTYPE = np.dtype([("id", "<i8")] + [(field, "<f8") for field in PICK_FIELDS])
+
+
+def empty_picks():
+    return np.zeros(0, dtype=PICK_DTYPE)
+
+
+def picks_from_records(records, first_id=1):
+    '''
+    Build a pick array from dicts with the PICK_FIELDS keys, assigning
+    consecutive ids starting at `first_id`.
+    '''
+    picks = np.zeros(len(records), dtype=PICK_DTYPE)
+    picks["id"] = np.arange(first_id, first_id + len(records))
+    for field in PICK_FIELDS:
+        picks[field] = [record[field] for record in records]
+    return picks
+
+
+def picks_from_columns(values, first_id=1):
+    '''Build a pick array from an (n, 7) array of .pck columns.'''
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2 or values.shape[1] != len(PICK_FIELDS):
+        raise ValueError(f"Expected {len(PICK_FIELDS)} columns per pick.")
+    picks = np.zeros(len(values), dtype=PICK_DTYPE)
+    picks["id"] = np.arange(first_id, first_id + len(values))
+    for column, field in enumerate(PICK_FIELDS):
+        picks[field] = values[:, column]
+    return picks
+
+
+def picks_to_columns(picks):
+    '''(n, 7) float64 array of the .pck columns.'''
+    columns = np.zeros((len(picks), len(PICK_FIELDS)))
+    for column, field in enumerate(PICK_FIELDS):
+        columns[:, column] = picks[field]
+    return columns
+
+
+def number_picks(picks, first_id):
+    '''Copy of `picks` with consecutive ids starting at `first_id`.'''
+    picks = np.array(picks, dtype=PICK_DTYPE)
+    picks["id"] = np.arange(first_id, first_id + len(picks))
+    return picks
+
+
+def check_pick_delta(known_ids, remove, move):
+    '''
+    Raise KeyError if a delta names an id more than once, in remove or in
+    move or in both, or removes or moves an id that is not in `known_ids`.
+    '''
+    changed = list(remove) + [pick_id for pick_id, _ in move]
+    if len(set(changed)) != len(changed):
+        raise KeyError("Pick id repeated in remove and move.")
+    for pick_id in changed:
+        if pick_id not in known_ids:
+            raise KeyError(f"Unknown pick id: {pick_id}")
+
+
+def parse_pck_text(text):
+    '''
+    Parse .pck text: one pick per line, seven whitespace separated
+    columns. Lines starting with # are ignored.
+    '''
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        text = bytes(text).decode()
+    if not text.strip():
+        return picks_from_columns(np.zeros((0, len(PICK_FIELDS))))
+    return picks_from_columns(np.loadtxt(io.StringIO(text), dtype=np.float64, ndmin=2))
+
+
+def parse_pck_binary(data):
+    '''
+    Parse binary picks: either a .npy file holding an (n, 7) array or a
+    structured array with the PICK_FIELDS names, or raw little-endian
+    float64 rows of the seven .pck columns.
+    '''
+    data = bytes(data)
+    if data.startswith(b"\x93NUMPY"):
+        array = np.load(io.BytesIO(data), allow_pickle=False)
+        if array.dtype.names is not None:
+            missing = [field for field in PICK_FIELDS if field not in array.dtype.names]
+            if missing:
+                raise ValueError(f"Missing pick fields: {missing}")
+            array = np.stack([array[field] for field in PICK_FIELDS], axis=1)
+        return picks_from_columns(array)
+    if len(data) % (8 * len(PICK_FIELDS)) != 0:
+        raise ValueError("Binary picks must be float64 rows of seven columns.")
+    return picks_from_columns(np.frombuffer(data, dtype="<f8").reshape(-1, len(PICK_FIELDS)))
+
+
+def format_pck_text(picks):
+    buffer = io.StringIO()
+    np.savetxt(buffer, picks_to_columns(picks), fmt="%.10g")
+    return buffer.getvalue()
+
+
+def as_pick_array(value):
+    '''Stored picks as an array; older projects stored a list of dicts.'''
+    if isinstance(value, np.ndarray):
+        return value.astype(PICK_DTYPE, copy=False)
+    return picks_from_records(value)
+
+
+def picks_to_records(picks):
+    names = picks.dtype.names
+    return [dict(zip(names, row)) for row in picks.tolist()]
@@ -0,0 +1,169 @@
+import numpy as np
+
+TEXT_HEADER_SIZE = 3200
+BINARY_HEADER_SIZE = 400
+TRACE_HEADER_SIZE = 240
+
+# Binary header fields as (name, byte position, type), using the 1-based
+# byte positions of the SEG-Y standard (and segyio.BinField)
+BINARY_HEADER_FIELDS = [
+    ("Interval", 3217, "i2"),
+    ("Samples", 3221, "u2"),
+    ("Format", 3225, "i2"),
+    ("SEGYRevision", 3501, "u2"),
+    ("ExtendedHeaders", 3505, "i2"),
+]
+
+# Trace header fields as (name, byte position, type), matching the names of
+# segyio.TraceField
+TRACE_HEADER_FIELDS = [
+    ("TRACE_SEQUENCE_LINE", 1, "i4"),
+    ("TRACE_SEQUENCE_FILE", 5, "i4"),
+    ("FieldRecord", 9, "i4"),
+    ("TraceNumber", 13, "i4"),
+    ("EnergySourcePoint", 17, "i4"),
+    ("CDP", 21, "i4"),
+    ("CDP_TRACE", 25, "i4"),
+    ("TraceIdentificationCode", 29, "i2"),
+    ("offset", 37, "i4"),
+    ("ReceiverGroupElevation", 41, "i4"),
+    ("SourceSurfaceElevation", 45, "i4"),
+    ("SourceDepth", 49, "i4"),
+    ("ElevationScalar", 69, "i2"),
+    ("SourceGroupScalar", 71, "i2"),
+    ("SourceX", 73, "i4"),
+    ("SourceY", 77, "i4"),
+    ("GroupX", 81, "i4"),
+    ("GroupY", 85, "i4"),
+    ("CoordinateUnits", 89, "i2"),
+    ("DelayRecordingTime", 109, "i2"),
+    ("TRACE_SAMPLE_COUNT", 115, "u2"),
+    ("TRACE_SAMPLE_INTERVAL", 117, "u2"),
+    ("CDP_X", 181, "i4"),
+    ("CDP_Y", 185, "i4"),
+]
+
+IBM_FLOAT_FORMAT = 1
+SAMPLE_FORMATS = {
+    IBM_FLOAT_FORMAT: "u4",
+    2: "i4",
+    3: "i2",
+    5: "f4",
+    6: "f8",
+    8: "i1",
+}
+
+
+def header_dtype(fields, byte_order, base_offset, itemsize):
+    return np.dtype({
+        "names": [name for name, _, _ in fields],
+        "formats": [byte_order + type_code for _, _, type_code in fields],
+        "offsets": [position - 1 - base_offset for _, position, _ in fields],
+        "itemsize": itemsize,
+    })
+
+
+def ibm_to_ieee(words):
+    '''
+    Convert big-endian IBM System/360 floats, given as their raw uint32
+    words, to float32.
+    '''
+    words = words.astype(np.uint32, copy=False)
+    sign = np.where(words >> 31, -1.0, 1.0)
+    exponent = ((words >> 24) & 0x7F).astype(np.int32)
+    mantissa = (words & 0x00FFFFFF).astype(np.float64)
+    return (sign * np.ldexp(mantissa, 4 * (exponent - 64) - 24)).astype(np.float32)
+
+
+class SegyFile:
+    '''
+    Memory-mapped SEG-Y reader for files with a fixed trace length.
+
+    `source` can be a path, an open binary file object or a bytes-like
+    buffer. Trace headers and raw samples are exposed as structured views
+    over the mapped data, so nothing is copied until values are read.
+    Raises ValueError for layouts it cannot map.
+    '''
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._raw = np.frombuffer(source, dtype=np.uint8)
+        else:
+            self._raw = np.memmap(source, dtype=np.uint8, mode="r")
+        if self._raw.size < TEXT_HEADER_SIZE + BINARY_HEADER_SIZE:
+            raise ValueError("File is too small to be a segy file.")
+
+        self.byte_order = self._detect_byte_order()
+        binary_header = self._raw[TEXT_HEADER_SIZE:TEXT_HEADER_SIZE + BINARY_HEADER_SIZE].view(
+            header_dtype(BINARY_HEADER_FIELDS, self.byte_order, TEXT_HEADER_SIZE, BINARY_HEADER_SIZE)
+        )[0]
+        self.format = int(binary_header["Format"])
+        n_extended = int(binary_header["ExtendedHeaders"]) if binary_header["SEGYRevision"] else 0
+        if n_extended < 0:
+            raise ValueError("Variable number of extended textual headers is not supported.")
+        self.data_offset = TEXT_HEADER_SIZE + BINARY_HEADER_SIZE + n_extended * TEXT_HEADER_SIZE
+
+        self.trace_header_dtype = header_dtype(TRACE_HEADER_FIELDS, self.byte_order, 0, TRACE_HEADER_SIZE)
+        first_header = self._raw[self.data_offset:self.data_offset + TRACE_HEADER_SIZE].view(self.trace_header_dtype)
+        if first_header.size == 0:
+            raise ValueError("No traces found in segy file.")
+        first_header = first_header[0]
+
+        self.n_samples = int(binary_header["Samples"]) or int(first_header["TRACE_SAMPLE_COUNT"])
+        interval = int(binary_header["Interval"]) or int(first_header["TRACE_SAMPLE_INTERVAL"])
+        if self.n_samples <= 0 or interval <= 0:
+            raise ValueError("Missing sample count or sample interval.")
+        self.sample_interval = interval / 1e6
+
+        sample_dtype = np.dtype(self.byte_order + SAMPLE_FORMATS[self.format])
+        self.trace_dtype = np.dtype([
+            ("header", self.trace_header_dtype),
+            ("data", sample_dtype, (self.n_samples,)),
+        ])
+        data_size = self._raw.size - self.data_offset
+        if data_size % self.trace_dtype.itemsize != 0:
+            raise ValueError("Trace length does not match the binary header.")
+        self.n_traces = data_size // self.trace_dtype.itemsize
+        self._traces = self._raw[self.data_offset:].view(self.trace_dtype)
+
+    def _detect_byte_order(self):
+        format_bytes = self._raw[3224:3226]
+        for byte_order in (">", "<"):
+            if int(format_bytes.view(byte_order + "i2")[0]) in SAMPLE_FORMATS:
+                return byte_order
+        raise ValueError("Unsupported segy sample format.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # The mapping is released once no views into it remain
+        self._traces = self._raw = None
+
+    @property
+    def trace_headers(self):
+        '''Structured (n_traces,) view of all trace headers.'''
+        return self._traces["header"]
+
+    @property
+    def raw_samples(self):
+        '''(n_traces, n_samples) view of the samples in their on-disk encoding.'''
+        return self._traces["data"]
+
+    def read_trace_fields(self, names):
+        return {name: np.array(self.trace_headers[name]) for name in names}
+
+    def read_traces(self, start=0, stop=None):
+        '''Decode traces [start, stop) to a native float32 array.'''
+        samples = self.raw_samples[start:stop]
+        if self.format == IBM_FLOAT_FORMAT:
+            return ibm_to_ieee(samples)
+        return samples.astype(np.float32)
+
+    def iter_trace_blocks(self, block_size=64):
+        '''Yield (start, traces) blocks so large files decode in bounded memory.'''
+        for start in range(0, self.n_traces, block_size):
+            yield start, self.read_traces(start, start + block_size)
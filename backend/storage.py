@@ -0,0 +1,616 @@
+import copy
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+import uuid
+from threading import RLock
+
+import numpy as np
+
+from cache import LRUByteCache
+from picks import PICK_DTYPE, PICK_FIELDS, as_pick_array, check_pick_delta, empty_picks, number_picks
+
+GRID_SECTION = "grids"
+PICK_SECTION = "picks"
+GRID_READ_ATTEMPTS = 3
+# Charge for a memory-mapped grid in the grid cache: its pages belong to the
+# OS page cache, but the number of open mappings is still bounded
+MAPPED_GRID_BYTES = 64 * 1024
+
+
+class VersionConflict(Exception):
+    '''Raised when a conditional write finds none of the expected etags current.'''
+
+
+def make_etag(epoch, versions):
+    '''
+    Entity tag for a set of sections, from their version counters. `epoch`
+    identifies the project instance so a recreated project never reuses
+    tags from an earlier one.
+    '''
+    key = json.dumps([epoch, sorted(versions.items())])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class ProjectStore:
+    '''
+    Persistence interface for project data. A project is a set of named
+    sections (geometry, records, plotLimits, picks, ...), each either
+    JSON-serializable or a NumPy array, plus an ordered list of named grid
+    arrays. Every section, and the grid
+    list, carries a version counter that is bumped on each write.
+
+    Pick ids come from a per-project counter that only grows: writing the
+    picks section renumbers every pick from it, and apply_pick_delta
+    numbers the added ones, so ids of removed picks are never reused.
+    '''
+
+    def has_project(self, project_id):
+        raise NotImplementedError
+
+    def create_project(self, project_id, sections):
+        '''Create the project with the given sections unless it already exists.'''
+        raise NotImplementedError
+
+    def get_section(self, project_id, name):
+        raise NotImplementedError
+
+    def get_grids(self, project_id):
+        '''List of {"name": str, "data": np.ndarray} in record order.'''
+        raise NotImplementedError
+
+    def write(self, project_id, sections=None, grids=None, expected_etags=None):
+        '''
+        Atomically replace the given sections and, unless `grids` is None,
+        the grid list. With `expected_etags`, raises VersionConflict unless
+        the current etag of exactly the names being written is among them.
+        Returns the new versions of the written names.
+        '''
+        raise NotImplementedError
+
+    def apply_pick_delta(self, project_id, add=None, remove=(), move=(), expected_etags=None):
+        '''
+        Add, remove and move picks without rewriting the others. `add` is a
+        pick array whose ids are replaced with new ones, and `move` a list of
+        (id, values) pairs updating some fields of one pick. Unknown or
+        repeated ids raise KeyError before anything is changed;
+        `expected_etags` is checked against the picks etag as in write.
+        Returns (versions, added ids, number of picks).
+        '''
+        raise NotImplementedError
+
+    def get_versions(self, project_id, names):
+        raise NotImplementedError
+
+    def get_etag(self, project_id, names):
+        raise NotImplementedError
+
+    def set_section(self, project_id, name, value):
+        self.write(project_id, sections={name: value})
+
+    def set_grids(self, project_id, grids):
+        self.write(project_id, grids=grids)
+
+    def close(self):
+        pass
+
+
+def encode_section(value):
+    '''
+    Sections are JSON text, except NumPy arrays (such as the pick table)
+    which are kept as .npy bytes.
+    '''
+    if isinstance(value, np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return buffer.getvalue()
+    return json.dumps(value)
+
+
+def decode_section(value):
+    if isinstance(value, bytes):
+        return np.load(io.BytesIO(value), allow_pickle=False)
+    return json.loads(value)
+
+
+def written_names(sections, grids):
+    return list(sections) + ([GRID_SECTION] if grids is not None else [])
+
+
+def as_float32_grids(grids):
+    return [
+        {"name": grid["name"], "data": np.asarray(grid["data"], dtype=np.float32)}
+        for grid in grids
+    ]
+
+
+class MemoryProjectStore(ProjectStore):
+    '''Process-local store, for development and tests.'''
+
+    def __init__(self):
+        self._projects = {}
+        self._lock = RLock()
+
+    def has_project(self, project_id):
+        return project_id in self._projects
+
+    def create_project(self, project_id, sections):
+        with self._lock:
+            if project_id not in self._projects:
+                self._projects[project_id] = {
+                    "epoch": uuid.uuid4().hex,
+                    "sections": {},
+                    "versions": {},
+                    "nextPickId": 1,
+                    GRID_SECTION: [],
+                }
+                self._set_sections(self._projects[project_id], sections)
+
+    def _set_sections(self, project, sections):
+        sections = copy.deepcopy(sections)
+        if PICK_SECTION in sections:
+            sections[PICK_SECTION] = number_picks(as_pick_array(sections[PICK_SECTION]), project["nextPickId"])
+            project["nextPickId"] += len(sections[PICK_SECTION])
+        project["sections"].update(sections)
+
+    def _bump_versions(self, project_id, names):
+        versions = self._projects[project_id]["versions"]
+        for name in names:
+            versions[name] = versions.get(name, 0) + 1
+        return self.get_versions(project_id, names)
+
+    def get_section(self, project_id, name):
+        with self._lock:
+            return copy.deepcopy(self._projects[project_id]["sections"][name])
+
+    def get_grids(self, project_id):
+        return list(self._projects[project_id][GRID_SECTION])
+
+    def write(self, project_id, sections=None, grids=None, expected_etags=None):
+        sections = sections or {}
+        names = written_names(sections, grids)
+        if grids is not None:
+            grids = as_float32_grids(grids)
+        with self._lock:
+            project = self._projects[project_id]
+            if expected_etags is not None and self.get_etag(project_id, names) not in expected_etags:
+                raise VersionConflict(project_id)
+            self._set_sections(project, sections)
+            if grids is not None:
+                project[GRID_SECTION] = grids
+            return self._bump_versions(project_id, names)
+
+    def apply_pick_delta(self, project_id, add=None, remove=(), move=(), expected_etags=None):
+        add = empty_picks() if add is None else add
+        with self._lock:
+            project = self._projects[project_id]
+            if expected_etags is not None and self.get_etag(project_id, [PICK_SECTION]) not in expected_etags:
+                raise VersionConflict(project_id)
+            picks = as_pick_array(project["sections"][PICK_SECTION])
+            check_pick_delta(set(picks["id"].tolist()), remove, move)
+
+            picks = picks[~np.isin(picks["id"], list(remove))]
+            rows = {int(pick_id): row for row, pick_id in enumerate(picks["id"])}
+            for pick_id, values in move:
+                for field, value in values.items():
+                    picks[rows[pick_id]][field] = value
+            added = number_picks(add, project["nextPickId"])
+            project["nextPickId"] += len(added)
+            project["sections"][PICK_SECTION] = np.concatenate([picks, added])
+            versions = self._bump_versions(project_id, [PICK_SECTION])
+            return versions, added["id"].tolist(), len(project["sections"][PICK_SECTION])
+
+    def get_versions(self, project_id, names):
+        with self._lock:
+            versions = self._projects[project_id]["versions"]
+            return {name: versions.get(name, 0) for name in names}
+
+    def get_etag(self, project_id, names):
+        return make_etag(self._projects[project_id]["epoch"], self.get_versions(project_id, names))
+
+
+class SqliteProjectStore(ProjectStore):
+    '''
+    SQLite (WAL mode) store. Sections are stored as JSON text, or .npy
+    bytes for arrays; grids are written as float32 .npy sidecar files
+    under `data_dir`, with their order and names recorded in the database.
+    Picks are rows of their own table, so a delta only touches the rows it
+    changes. WAL lets several server processes share the same database file.
+    '''
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.grid_dir = os.path.join(data_dir, "grids")
+        os.makedirs(self.grid_dir, exist_ok=True)
+        self._lock = RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(data_dir, "projects.db"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS projects (
+                id TEXT PRIMARY KEY,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sections (
+                project_id TEXT NOT NULL REFERENCES projects(id),
+                name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (project_id, name)
+            );
+            CREATE TABLE IF NOT EXISTS grids (
+                project_id TEXT NOT NULL REFERENCES projects(id),
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                PRIMARY KEY (project_id, position)
+            );
+            CREATE TABLE IF NOT EXISTS versions (
+                project_id TEXT NOT NULL REFERENCES projects(id),
+                name TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                PRIMARY KEY (project_id, name)
+            );
+            CREATE TABLE IF NOT EXISTS picks (
+                project_id TEXT NOT NULL REFERENCES projects(id),
+                id INTEGER NOT NULL,
+                %s,
+                PRIMARY KEY (project_id, id)
+            );
+            CREATE TABLE IF NOT EXISTS pick_counters (
+                project_id TEXT PRIMARY KEY REFERENCES projects(id),
+                next_id INTEGER NOT NULL
+            );
+        """ % ",\n                ".join(f"{field} REAL NOT NULL" for field in PICK_FIELDS))
+
+    def _project_grid_dir(self, project_id):
+        # Hash ids so arbitrary project ids are safe as directory names
+        return os.path.join(self.grid_dir, hashlib.sha256(project_id.encode()).hexdigest()[:32])
+
+    def has_project(self, project_id):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone()
+        return row is not None
+
+    def create_project(self, project_id, sections):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO projects (id, created) VALUES (?, ?)", (project_id, time.time())
+                )
+                if cursor.rowcount:
+                    self._conn.executemany(
+                        "INSERT INTO sections (project_id, name, value) VALUES (?, ?, ?)",
+                        [
+                            (project_id, name, encode_section(value))
+                            for name, value in sections.items() if name != PICK_SECTION
+                        ],
+                    )
+                    if PICK_SECTION in sections:
+                        self._write_picks(project_id, sections[PICK_SECTION])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_section(self, project_id, name):
+        with self._lock:
+            if name == PICK_SECTION:
+                return self._picks(project_id)
+            row = self._conn.execute(
+                "SELECT value FROM sections WHERE project_id = ? AND name = ?", (project_id, name)
+            ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return decode_section(row[0])
+
+    def _picks(self, project_id):
+        rows = self._conn.execute(
+            f"SELECT id, {', '.join(PICK_FIELDS)} FROM picks WHERE project_id = ? ORDER BY id", (project_id,)
+        ).fetchall()
+        return np.array(rows, dtype=PICK_DTYPE)
+
+    def _next_pick_id(self, project_id):
+        row = self._conn.execute("SELECT next_id FROM pick_counters WHERE project_id = ?", (project_id,)).fetchone()
+        return row[0] if row else 1
+
+    def _insert_picks(self, project_id, picks):
+        self._conn.executemany(
+            f"INSERT INTO picks (project_id, id, {', '.join(PICK_FIELDS)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(PICK_FIELDS))})",
+            [(project_id, *row) for row in picks.tolist()],
+        )
+
+    def _set_next_pick_id(self, project_id, next_id):
+        self._conn.execute(
+            "INSERT INTO pick_counters (project_id, next_id) VALUES (?, ?) "
+            "ON CONFLICT (project_id) DO UPDATE SET next_id = excluded.next_id",
+            (project_id, next_id),
+        )
+
+    def _write_picks(self, project_id, picks):
+        '''Replace all picks of a project, numbered from its pick counter.'''
+        first_id = self._next_pick_id(project_id)
+        picks = number_picks(as_pick_array(picks), first_id)
+        self._conn.execute("DELETE FROM picks WHERE project_id = ?", (project_id,))
+        self._insert_picks(project_id, picks)
+        self._set_next_pick_id(project_id, first_id + len(picks))
+
+    def _known_pick_ids(self, project_id, ids):
+        known = set()
+        ids = list(ids)
+        # Stay well below SQLite's limit on query parameters
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            known.update(row[0] for row in self._conn.execute(
+                f"SELECT id FROM picks WHERE project_id = ? AND id IN ({', '.join('?' * len(chunk))})",
+                (project_id, *chunk),
+            ))
+        return known
+
+    def _grid_rows(self, project_id):
+        return self._conn.execute(
+            "SELECT name, file_name FROM grids WHERE project_id = ? ORDER BY position", (project_id,)
+        ).fetchall()
+
+    def get_grids(self, project_id):
+        '''
+        Grids are returned as read-only memory maps of the .npy files, so
+        opening a project does not read the grid data until it is used.
+        '''
+        directory = self._project_grid_dir(project_id)
+        for attempt in range(GRID_READ_ATTEMPTS):
+            with self._lock:
+                rows = self._grid_rows(project_id)
+            try:
+                return [
+                    {"name": name, "data": np.load(os.path.join(directory, file_name), mmap_mode="r")}
+                    for name, file_name in rows
+                ]
+            except FileNotFoundError:
+                # Replaced by another process between reading the rows and the files
+                if attempt == GRID_READ_ATTEMPTS - 1:
+                    raise
+
+    def _versions(self, project_id, names):
+        versions = dict.fromkeys(names, 0)
+        for name, version in self._conn.execute(
+            "SELECT name, version FROM versions WHERE project_id = ?", (project_id,)
+        ):
+            if name in versions:
+                versions[name] = version
+        return versions
+
+    def _etag(self, project_id, names):
+        row = self._conn.execute("SELECT created FROM projects WHERE id = ?", (project_id,)).fetchone()
+        return make_etag(row[0] if row else None, self._versions(project_id, names))
+
+    def _bump_versions(self, project_id, names):
+        self._conn.executemany(
+            "INSERT INTO versions (project_id, name, version) VALUES (?, ?, 1) "
+            "ON CONFLICT (project_id, name) DO UPDATE SET version = version + 1",
+            [(project_id, name) for name in names],
+        )
+        return self._versions(project_id, names)
+
+    def get_versions(self, project_id, names):
+        with self._lock:
+            return self._versions(project_id, names)
+
+    def get_etag(self, project_id, names):
+        with self._lock:
+            return self._etag(project_id, names)
+
+    def write(self, project_id, sections=None, grids=None, expected_etags=None):
+        sections = sections or {}
+        names = written_names(sections, grids)
+        directory = self._project_grid_dir(project_id)
+        rows = []
+        if grids is not None:
+            os.makedirs(directory, exist_ok=True)
+            for position, grid in enumerate(grids):
+                file_name = uuid.uuid4().hex + ".npy"
+                np.save(os.path.join(directory, file_name), np.asarray(grid["data"], dtype=np.float32))
+                rows.append((project_id, position, grid["name"], file_name))
+
+        old_rows = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if expected_etags is not None and self._etag(project_id, names) not in expected_etags:
+                    raise VersionConflict(project_id)
+                self._conn.executemany(
+                    "INSERT INTO sections (project_id, name, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (project_id, name) DO UPDATE SET value = excluded.value",
+                    [
+                        (project_id, name, encode_section(value))
+                        for name, value in sections.items() if name != PICK_SECTION
+                    ],
+                )
+                if PICK_SECTION in sections:
+                    self._write_picks(project_id, sections[PICK_SECTION])
+                if grids is not None:
+                    old_rows = self._grid_rows(project_id)
+                    self._conn.execute("DELETE FROM grids WHERE project_id = ?", (project_id,))
+                    self._conn.executemany(
+                        "INSERT INTO grids (project_id, position, name, file_name) VALUES (?, ?, ?, ?)", rows
+                    )
+                versions = self._bump_versions(project_id, names)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                for _, _, _, file_name in rows:
+                    os.remove(os.path.join(directory, file_name))
+                raise
+
+        # Old files are only removed once the new rows are committed. Open
+        # memory maps keep their data on POSIX; where the OS refuses to delete
+        # a mapped file it is left behind.
+        for _, file_name in old_rows:
+            try:
+                os.remove(os.path.join(directory, file_name))
+            except (FileNotFoundError, PermissionError):
+                pass
+        return versions
+
+    def apply_pick_delta(self, project_id, add=None, remove=(), move=(), expected_etags=None):
+        add = empty_picks() if add is None else add
+        remove, move = list(remove), list(move)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if expected_etags is not None and self._etag(project_id, [PICK_SECTION]) not in expected_etags:
+                    raise VersionConflict(project_id)
+                check_pick_delta(
+                    self._known_pick_ids(project_id, remove + [pick_id for pick_id, _ in move]), remove, move
+                )
+
+                self._conn.executemany(
+                    "DELETE FROM picks WHERE project_id = ? AND id = ?", [(project_id, pick_id) for pick_id in remove]
+                )
+                for pick_id, values in move:
+                    fields = [field for field in PICK_FIELDS if field in values]
+                    if fields:
+                        self._conn.execute(
+                            f"UPDATE picks SET {', '.join(f'{field} = ?' for field in fields)} "
+                            "WHERE project_id = ? AND id = ?",
+                            (*(values[field] for field in fields), project_id, pick_id),
+                        )
+                first_id = self._next_pick_id(project_id)
+                added = number_picks(add, first_id)
+                self._insert_picks(project_id, added)
+                self._set_next_pick_id(project_id, first_id + len(added))
+
+                versions = self._bump_versions(project_id, [PICK_SECTION])
+                count = self._conn.execute("SELECT COUNT(*) FROM picks WHERE project_id = ?", (project_id,)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return versions, added["id"].tolist(), count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedProjectStore(ProjectStore):
+    '''
+    Keeps the grids of recently used projects in memory under a byte
+    budget, in front of a persistent store. Only grids held in memory count
+    their size against the budget; memory-mapped ones count
+    MAPPED_GRID_BYTES each. Grids are written through to
+    the backing store, so evicting a project only drops its in-memory copy;
+    the next get_grids reloads it lazily from disk. Cached grids are
+    checked against the grid version counter so updates made by
+    other server processes are picked up.
+    '''
+
+    def __init__(self, backing, max_bytes):
+        self.backing = backing
+        self.grid_cache = LRUByteCache(max_bytes)
+
+    def has_project(self, project_id):
+        return self.backing.has_project(project_id)
+
+    def create_project(self, project_id, sections):
+        self.backing.create_project(project_id, sections)
+
+    def get_section(self, project_id, name):
+        return self.backing.get_section(project_id, name)
+
+    def _cache(self, project_id, version, grids):
+        size = sum(
+            MAPPED_GRID_BYTES if isinstance(grid["data"], np.memmap) else grid["data"].nbytes
+            for grid in grids
+        )
+        self.grid_cache.put(project_id, (version, grids), size=size)
+
+    def _grids_version(self, project_id):
+        return self.backing.get_versions(project_id, [GRID_SECTION])[GRID_SECTION]
+
+    def get_grids(self, project_id):
+        version = self._grids_version(project_id)
+        cached = self.grid_cache.get(project_id)
+        if cached is not None and cached[0] == version:
+            return list(cached[1])
+        grids = self.backing.get_grids(project_id)
+        self._cache(project_id, version, grids)
+        return list(grids)
+
+    def write(self, project_id, sections=None, grids=None, expected_etags=None):
+        if grids is not None:
+            grids = as_float32_grids(grids)
+        versions = self.backing.write(project_id, sections, grids, expected_etags)
+        if grids is not None:
+            self._cache(project_id, versions[GRID_SECTION], grids)
+        return versions
+
+    def apply_pick_delta(self, project_id, add=None, remove=(), move=(), expected_etags=None):
+        return self.backing.apply_pick_delta(project_id, add, remove, move, expected_etags)
+
+    def get_versions(self, project_id, names):
+        return self.backing.get_versions(project_id, names)
+
+    def get_etag(self, project_id, names):
+        return self.backing.get_etag(project_id, names)
+
+    def close(self):
+        self.backing.close()
+
+
+class Project:
+    '''
+    Dict-style view of one stored project: `project["geometry"]` reads a
+    section and `project["grids"]` the grid list; assignments write through
+    to the store.
+    '''
+
+    def __init__(self, store, project_id):
+        self.store = store
+        self.project_id = project_id
+
+    def __getitem__(self, name):
+        if name == GRID_SECTION:
+            return self.store.get_grids(self.project_id)
+        return self.store.get_section(self.project_id, name)
+
+    def __setitem__(self, name, value):
+        if name == GRID_SECTION:
+            self.store.set_grids(self.project_id, value)
+        else:
+            self.store.set_section(self.project_id, name, value)
+
+    def etag(self, names):
+        return self.store.get_etag(self.project_id, names)
+
+    def version(self, name):
+        return self.store.get_versions(self.project_id, [name])[name]
+
+    def update(self, values, expected_etags=None):
+        '''
+        Write several sections (and "grids") in one step, optionally only
+        if their current etag is one of `expected_etags`.
+        '''
+        sections = {name: value for name, value in values.items() if name != GRID_SECTION}
+        return self.store.write(self.project_id, sections, values.get(GRID_SECTION), expected_etags)
+
+    def apply_pick_delta(self, add=None, remove=(), move=(), expected_etags=None):
+        '''Change some picks in place; see ProjectStore.apply_pick_delta.'''
+        return self.store.apply_pick_delta(self.project_id, add, remove, move, expected_etags)
+
+
+def create_project_store(kind, data_dir, cache_max_bytes):
+    if kind == "memory":
+        return MemoryProjectStore()
+    if kind == "sqlite":
+        return CachedProjectStore(SqliteProjectStore(data_dir), cache_max_bytes)
+    raise ValueError(f"Unknown project store: {kind}")
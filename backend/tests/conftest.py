@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SGY_SAMPLES_DIR = os.path.join(BACKEND_DIR, "..", "docs", "Geometry", "samples", "sgy")
+
+# The backend modules are imported as top-level modules, as in main.py
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    '''Test client for the app, with an in-memory project store and caches under a temporary directory.'''
+    from fastapi.testclient import TestClient
+
+    directory = tmp_path_factory.mktemp("server")
+    os.environ["PROJECT_STORE"] = "memory"
+    os.environ["RESULT_CACHE_DIR"] = str(directory / "result_cache")
+    os.environ["INVERSION_CHECKPOINT_DIR"] = str(directory / "inversion_checkpoints")
+    # main loads its placeholder axes relative to the backend directory
+    cwd = os.getcwd()
+    os.chdir(BACKEND_DIR)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,31 @@
+import numpy as np
+
+from autopick import autopick_grid
+from dispersion import compute_dispersion_grid, get_freq_axis, get_slow_axis
+
+
+def normalized(grid):
+    return grid / grid.max(axis=0, keepdims=True)
+
+
+def test_picks_ridge():
+    freq = np.linspace(1, 50, 50)
+    slow = np.linspace(0, 0.01, 101)
+    ridge = np.linspace(80, 30, len(freq))
+    rows = np.arange(len(slow))[:, None]
+    grid = np.exp(-0.5 * ((rows - ridge) / 2) ** 2) + 0.01
+
+    picks = autopick_grid(normalized(grid), freq, slow)
+    assert len(picks) == len(freq)
+    np.testing.assert_allclose(picks["d3"], ridge, atol=0.5)
+
+
+def test_noise_record_is_not_picked():
+    # Grid columns are normalized, so noise peaks have amplitude 1 like ridges
+    traces = np.random.default_rng(0).standard_normal((24, 1000)).astype(np.float32)
+    offsets = 2.0 + 2.0 * np.arange(24)
+    freq = get_freq_axis(50, 100)
+    slow = get_slow_axis(0.01, 100)
+    grid = compute_dispersion_grid(traces, 0.001, offsets, freq, slow)
+
+    assert len(autopick_grid(grid, freq, slow)) < 5
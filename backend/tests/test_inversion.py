@@ -0,0 +1,70 @@
+import numpy as np
+
+from inversion import invert_layers, predicted_velocities
+from picks import picks_from_columns
+
+
+def synthetic_picks(thickness, vs):
+    '''Picks lying exactly on the curve of a model.'''
+    frequencies = np.geomspace(3, 60, 40)
+    velocities = predicted_velocities(1 / frequencies, thickness, vs, np.full(len(vs), 2.0))
+    columns = np.zeros((len(frequencies), 7))
+    columns[:, 2] = frequencies
+    columns[:, 4] = 1 / velocities
+    return picks_from_columns(columns)
+
+
+def starting_layers(thickness, vs, velocity_factor=1.0, thickness_factor=1.0):
+    depths = np.concatenate([[0], np.cumsum(thickness * thickness_factor)])
+    return [
+        {
+            "startDepth": float(depths[i]),
+            "endDepth": float(depths[i + 1]),
+            "velocity": float(velocity_factor * vs[i]),
+            "density": 2.0,
+        }
+        for i in range(len(vs))
+    ]
+
+
+def fitted_velocities(result):
+    return np.array([layer["velocity"] for layer in result["layers"]])
+
+
+def test_recovers_ten_layer_velocities():
+    thickness = np.full(10, 4.0)
+    vs = np.linspace(180, 900, 10)
+    result = invert_layers(starting_layers(thickness, vs, 1.2), synthetic_picks(thickness, vs), fit_thickness=False)
+    assert result["initialMisfit"] > 50
+    assert result["misfit"] < 1e-6
+    np.testing.assert_allclose(fitted_velocities(result), vs, rtol=1e-6)
+
+
+def test_recovers_velocities_and_thicknesses():
+    thickness = np.array([5.0, 10.0, 0.0])
+    vs = np.array([200.0, 400.0, 800.0])
+    layers = starting_layers(thickness, vs, 1.2, 1.2)
+    result = invert_layers(layers, synthetic_picks(thickness, vs))
+    assert result["misfit"] < 1e-6
+    np.testing.assert_allclose(fitted_velocities(result), vs, rtol=1e-6)
+    np.testing.assert_allclose([layer["endDepth"] for layer in result["layers"][:2]], [5.0, 15.0])
+
+
+def test_no_iterations_returns_layers_unchanged():
+    thickness = np.array([30.0, 14.0, 100.0])
+    vs = np.array([760.0, 1061.0, 1270.657])
+    layers = starting_layers(thickness, vs)
+    result = invert_layers(layers, synthetic_picks(thickness, vs * 0.9), max_iterations=0)
+    assert result["layers"] == layers
+    assert result["iterations"] == 0
+
+
+def test_fits_ten_layer_model_with_thicknesses():
+    # Far enough from the start that heavily damped steps stall for a while
+    rng = np.random.default_rng(3)
+    vs = np.sort(rng.uniform(180, 900, 10))
+    thickness = rng.uniform(2, 10, 10)
+    layers = starting_layers(thickness, vs, 1.2)
+    result = invert_layers(layers, synthetic_picks(thickness, vs))
+    assert result["initialMisfit"] > 50
+    assert result["misfit"] < 0.1
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import segyio
+
+from segy import SegyFile, ibm_to_ieee, TEXT_HEADER_SIZE, BINARY_HEADER_SIZE
+from utils import get_traces_from_sgy
+
+N_TRACES = 4
+N_SAMPLES = 50
+
+
+def write_sgy(path, sample_format, endian="big", ext_headers=0, revision=0, dtype=np.float32):
+    '''Small segy file written by segyio. Returns the path and the written traces.'''
+    spec = segyio.spec()
+    spec.format = sample_format
+    spec.samples = np.arange(N_SAMPLES)
+    spec.tracecount = N_TRACES
+    spec.endian = endian
+    spec.ext_headers = ext_headers
+    traces = (np.arange(N_TRACES * N_SAMPLES).reshape(N_TRACES, N_SAMPLES) * 1.5 - 77).astype(dtype)
+    with segyio.create(str(path), spec) as f:
+        f.bin.update({segyio.BinField.Interval: 1000})
+        for i, trace in enumerate(traces):
+            f.header[i] = {segyio.TraceField.GroupX: 100 * i}
+            f.trace[i] = trace
+    if revision:
+        # segyio writes revision 0, which leaves the extended header count unassigned
+        with open(path, "r+b") as f:
+            f.seek(3500)
+            f.write(int(revision).to_bytes(2, "little" if endian == "little" else "big"))
+    return str(path), traces
+
+
+def segyio_traces(path, endian="big"):
+    with segyio.open(path, ignore_geometry=True, endian=endian) as f:
+        return segyio.tools.collect(f.trace[:]).astype(np.float32)
+
+
+def test_ibm_to_ieee_known_values():
+    words = np.array([0x41100000, 0xC276A000, 0x42640000, 0x00000000], dtype=np.uint32)
+    np.testing.assert_array_equal(ibm_to_ieee(words), [1.0, -118.625, 100.0, 0.0])
+
+
+def test_ibm_float_traces_match_segyio(tmp_path):
+    path, traces = write_sgy(tmp_path / "ibm.sgy", segyio.SegySampleFormat.IBM_FLOAT_4_BYTE)
+    with SegyFile(path) as f:
+        assert f.format == 1
+        decoded = f.read_traces()
+    np.testing.assert_array_equal(decoded, segyio_traces(path))
+    np.testing.assert_array_equal(decoded, traces)
+
+
+@pytest.mark.parametrize("sample_format, dtype", [
+    (segyio.SegySampleFormat.IEEE_FLOAT_4_BYTE, np.float32),
+    (segyio.SegySampleFormat.SIGNED_SHORT_2_BYTE, np.int16),
+])
+def test_little_endian_file(tmp_path, sample_format, dtype):
+    path, traces = write_sgy(tmp_path / "little.sgy", sample_format, endian="little", dtype=dtype)
+    with SegyFile(path) as f:
+        assert f.byte_order == "<"
+        assert f.sample_interval == 0.001
+        np.testing.assert_array_equal(f.read_traces(), segyio_traces(path, endian="little"))
+        np.testing.assert_array_equal(f.read_trace_fields(["GroupX"])["GroupX"], [0, 100, 200, 300])
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path, _ = write_sgy(tmp_path / "full.sgy", segyio.SegySampleFormat.IEEE_FLOAT_4_BYTE)
+    with open(path, "rb") as f:
+        content = f.read()
+    with pytest.raises(ValueError):
+        SegyFile(content[:-7])
+    with pytest.raises(ValueError):
+        SegyFile(content[:TEXT_HEADER_SIZE + BINARY_HEADER_SIZE - 1])
+
+
+def test_extended_headers_offset(tmp_path):
+    path, traces = write_sgy(
+        tmp_path / "extended.sgy", segyio.SegySampleFormat.IEEE_FLOAT_4_BYTE, ext_headers=2, revision=0x0100
+    )
+    with SegyFile(path) as f:
+        assert f.data_offset == TEXT_HEADER_SIZE + BINARY_HEADER_SIZE + 2 * TEXT_HEADER_SIZE
+        np.testing.assert_array_equal(f.read_traces(), traces)
+
+
+@pytest.mark.parametrize("options", [
+    # Sample format the memory-mapped reader does not decode
+    {"sample_format": segyio.SegySampleFormat.UNSIGNED_SHORT_2_BYTE, "dtype": np.uint16},
+    # Revision 0 extended headers, which only segyio honors
+    {"sample_format": segyio.SegySampleFormat.IEEE_FLOAT_4_BYTE, "ext_headers": 1},
+], ids=["uint16", "revision-0-extended-headers"])
+def test_segyio_fallback(tmp_path, options):
+    path, traces = write_sgy(tmp_path / "fallback.sgy", **options)
+    with pytest.raises(ValueError):
+        SegyFile(path)
+    decoded, dt = get_traces_from_sgy(path)
+    np.testing.assert_array_equal(decoded, traces.astype(np.float32))
+    assert dt == 0.001
@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from picks import picks_from_columns
+from storage import MemoryProjectStore, SqliteProjectStore, VersionConflict
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = MemoryProjectStore() if request.param == "memory" else SqliteProjectStore(str(tmp_path))
+    store.create_project("p", {"picks": picks_from_columns(np.zeros((0, 7)))})
+    yield store
+    store.close()
+
+
+def new_picks(*frequencies):
+    columns = np.zeros((len(frequencies), 7))
+    columns[:, 2] = frequencies
+    columns[:, 4] = 0.01
+    return picks_from_columns(columns)
+
+
+def stored(store):
+    picks = store.get_section("p", "picks")
+    return dict(zip(picks["id"].tolist(), picks["frequency"].tolist()))
+
+
+def test_delta_adds_removes_and_moves(store):
+    store.write("p", sections={"picks": new_picks(1, 2, 3)})
+    versions, ids, count = store.apply_pick_delta(
+        "p", add=new_picks(4), remove=[2], move=[(3, {"frequency": 30.0})]
+    )
+    assert ids == [4]
+    assert count == 3
+    assert versions == {"picks": 2}
+    assert stored(store) == {1: 1.0, 3: 30.0, 4: 4.0}
+
+
+def test_ids_are_never_reused(store):
+    store.write("p", sections={"picks": new_picks(1, 2)})
+    store.apply_pick_delta("p", remove=[2])
+    _, ids, _ = store.apply_pick_delta("p", add=new_picks(5))
+    assert ids == [3]
+    # Writing the whole section numbers the picks from the same counter
+    store.write("p", sections={"picks": new_picks(6, 7)})
+    assert list(stored(store)) == [4, 5]
+
+
+@pytest.mark.parametrize("remove, move", [
+    ([1], [(1, {"frequency": 9.0})]),
+    ([], [(1, {"frequency": 9.0}), (1, {"frequency": 8.0})]),
+    ([1, 1], []),
+    ([7], []),
+    ([], [(7, {"frequency": 9.0})]),
+], ids=["removed-and-moved", "moved-twice", "removed-twice", "unknown-remove", "unknown-move"])
+def test_invalid_delta_changes_nothing(store, remove, move):
+    store.write("p", sections={"picks": new_picks(1, 2)})
+    with pytest.raises(KeyError):
+        store.apply_pick_delta("p", add=new_picks(3), remove=remove, move=move)
+    assert stored(store) == {1: 1.0, 2: 2.0}
+    assert store.get_versions("p", ["picks"]) == {"picks": 1}
+    _, ids, _ = store.apply_pick_delta("p", add=new_picks(3))
+    assert ids == [3]
+
+
+def test_delta_checks_expected_etags(store):
+    store.write("p", sections={"picks": new_picks(1)})
+    etag = store.get_etag("p", ["picks"])
+    store.apply_pick_delta("p", add=new_picks(2), expected_etags={etag})
+    with pytest.raises(VersionConflict):
+        store.apply_pick_delta("p", remove=[1], expected_etags={etag})
+    assert stored(store) == {1: 1.0, 2: 2.0}
+
+
+def test_concurrent_deltas_get_distinct_ids(store):
+    # Handlers call the store from worker threads
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda f: store.apply_pick_delta("p", add=new_picks(f)), range(1, 41)))
+    ids = [i for _, added, _ in results for i in added]
+    assert sorted(ids) == list(range(1, 41))
+    assert sorted(stored(store)) == list(range(1, 41))
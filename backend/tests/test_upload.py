@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from conftest import SGY_SAMPLES_DIR
+
+
+def sample_sgy():
+    with open(os.path.join(SGY_SAMPLES_DIR, "0078.sgy"), "rb") as f:
+        return f.read()
+
+
+def test_sgy_geometry(client):
+    response = client.post("/extractSgyGeom", files={"sgy_file": ("record.sgy", sample_sgy())})
+    assert response.status_code == 200
+    assert len(response.json()) > 0
+
+
+@pytest.mark.parametrize("content", [
+    b"garbage",
+    b"\x01" * 5000,
+    sample_sgy()[:len(sample_sgy()) // 2 + 7],
+], ids=["garbage", "junk", "truncated"])
+def test_malformed_sgy_is_rejected(client, content):
+    # The in-memory upload must be released even when parsing fails
+    response = client.post("/extractSgyGeom", files={"sgy_file": ("record.sgy", content)})
+    assert response.status_code == 400
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from velmodel import phase_velocities, curve_from_layers, check_curve_range, VP_VS_RATIO, DEFAULT_DENSITY, MAX_CURVE_PERIODS
+
+PERIODS = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5]
+
+# CalcCurve (frontend/src/utils/disper-util.ts) at PERIODS for
+# (thicknesses, shear velocities, phase_vel_min, phase_vel_max)
+CALC_CURVE_REFERENCE = [
+    (
+        [10, 20, 0], [200, 400, 800], 180, 880,
+        [183.87805533683795, 183.87836474091802, 184.88363262207076,
+         209.64999970233933, 379.5749555343008, 640.7042012058088],
+    ),
+    (
+        [5, 15, 0], [300, 150, 600], 120, 660,
+        [151.50095115456455, 150.50093882378783, 156.49453956972877,
+         178.73636129351786, 174.448627967313, 465.47526440242274],
+    ),
+]
+
+
+def curve(thickness, vs, phase_vel_min, phase_vel_max):
+    vs = np.asarray(vs, dtype=np.float64)
+    rho = np.full(vs.shape, DEFAULT_DENSITY)
+    return phase_velocities(
+        PERIODS, np.asarray(thickness, dtype=np.float64), vs * VP_VS_RATIO, vs, rho, phase_vel_min, phase_vel_max
+    )
+
+
+def test_half_space_rayleigh_velocity():
+    # For a Poisson solid the Rayleigh velocity is sqrt(2 - 2 / sqrt(3)) = 0.9194 times Vs at every period
+    velocities = curve([0], [500], 400, 550)
+    np.testing.assert_allclose(velocities, 500 * np.sqrt(2 - 2 / np.sqrt(3)), rtol=1e-5)
+
+
+def test_thick_top_layer_tends_to_its_rayleigh_velocity():
+    velocities = curve([1000, 0], [300, 900], 200, 1000)
+    np.testing.assert_allclose(velocities[0], 300 * np.sqrt(2 - 2 / np.sqrt(3)), rtol=1e-5)
+
+
+@pytest.mark.parametrize("thickness, vs, phase_vel_min, phase_vel_max, expected", CALC_CURVE_REFERENCE)
+def test_matches_calc_curve(thickness, vs, phase_vel_min, phase_vel_max, expected):
+    # CalcCurve only refines roots to 1%
+    np.testing.assert_allclose(curve(thickness, vs, phase_vel_min, phase_vel_max), expected, rtol=1e-2)
+
+
+def test_batched_models_match_single_models():
+    models = [(thickness, vs) for thickness, vs, *_ in CALC_CURVE_REFERENCE]
+    thickness = np.array([m[0] for m in models], dtype=np.float64)
+    vs = np.array([m[1] for m in models], dtype=np.float64)
+    batched = curve(thickness, vs, 120, 880)
+    for row, (t, v) in enumerate(models):
+        np.testing.assert_array_equal(batched[row], curve(t, v, 120, 880))
+
+
+def test_no_root_in_range_is_nan():
+    velocities = curve([0], [500], 470, 550)
+    assert np.isnan(velocities).all()
+
+
+def test_curve_from_layers():
+    layers = [
+        {"startDepth": 0, "endDepth": 10, "velocity": 200, "density": None},
+        {"startDepth": 10, "endDepth": 30, "velocity": 400, "density": None},
+        {"startDepth": 30, "endDepth": 30, "velocity": 800, "density": None},
+    ]
+    np.testing.assert_array_equal(
+        curve_from_layers(layers, PERIODS, 180, 880), curve([10, 20, 0], [200, 400, 800], 180, 880)
+    )
+
+
+def test_curve_range_limits():
+    check_curve_range(PERIODS, 100, 500, 0.02)
+    with pytest.raises(ValueError):
+        check_curve_range(PERIODS, 100, 500, 1e-4)
+    with pytest.raises(ValueError):
+        check_curve_range(np.linspace(0.01, 1, MAX_CURVE_PERIODS + 1), 100, 500)
@@ -0,0 +1,157 @@
+import base64
+import io
+import json
+import uuid
+from typing import Optional
+
+import numpy as np
+from fastapi import Request
+from starlette.responses import StreamingResponse
+
+NPY_MEDIA_TYPE = "application/x-npy"
+OCTET_STREAM_MEDIA_TYPE = "application/octet-stream"
+MULTIPART_MEDIA_TYPE = "multipart/mixed"
+BINARY_FORMATS = ("npy", "binary")
+BINARY_MEDIA_TYPES = (NPY_MEDIA_TYPE, OCTET_STREAM_MEDIA_TYPE, MULTIPART_MEDIA_TYPE)
+
+
+def wants_binary(request: Request, response_format: Optional[str] = None):
+    '''
+    Binary responses are opt-in, either with ?format=npy / ?format=binary or
+    with an Accept header naming one of the binary media types.
+    '''
+    if response_format is not None:
+        return response_format.lower() in BINARY_FORMATS
+    accept = request.headers.get("accept", "").lower()
+    return any(media_type in accept for media_type in BINARY_MEDIA_TYPES)
+
+
+def quote_etag(etag):
+    return f'"{etag}"'
+
+
+def parse_etags(header):
+    '''Bare entity tags listed in an If-Match / If-None-Match header.'''
+    tags = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tags.append(tag.strip('"'))
+    return tags
+
+
+def etag_matches(header, etag):
+    '''True if the header is "*" or lists `etag`. Weak tags compare equal.'''
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in parse_etags(header)
+
+
+def as_float32(array):
+    return np.ascontiguousarray(array, dtype=np.float32)
+
+
+def npy_header(array):
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(buffer, np.lib.format.header_data_from_array_1_0(array))
+    return buffer.getvalue()
+
+
+def iter_npy(array):
+    '''
+    Yield an array in .npy format. The data section is yielded as a
+    memoryview over the array's buffer so it is sent without a copy.
+    '''
+    yield npy_header(array)
+    if array.size:
+        yield memoryview(array).cast("B")
+
+
+def npy_response(array, name=None, dtype=np.float32):
+    array = np.ascontiguousarray(array, dtype=dtype)
+    headers = {"Content-Length": str(len(npy_header(array)) + array.nbytes)}
+    if name is not None:
+        headers["X-Grid-Name"] = json.dumps(name)
+    return StreamingResponse(iter_npy(array), media_type=NPY_MEDIA_TYPE, headers=headers)
+
+
+def multipart_npy_response(metadata, arrays):
+    '''
+    multipart/mixed response. The first part is JSON metadata, followed by
+    one application/x-npy part per (part_name, array) in `arrays`, in order.
+    '''
+    boundary = uuid.uuid4().hex
+    arrays = [(part_name, as_float32(array)) for part_name, array in arrays]
+
+    def body():
+        yield (
+            f"--{boundary}\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Disposition: inline; name=\"metadata\"\r\n\r\n"
+        ).encode()
+        yield json.dumps(metadata).encode()
+        yield b"\r\n"
+        for part_name, array in arrays:
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: {NPY_MEDIA_TYPE}\r\n"
+                f"Content-Disposition: attachment; name=\"{part_name}\"\r\n\r\n"
+            ).encode()
+            yield from iter_npy(array)
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return StreamingResponse(body(), media_type=f"{MULTIPART_MEDIA_TYPE}; boundary={boundary}")
+
+
+def grids_response(grids, freq=None, slow=None):
+    '''
+    Binary counterpart of the JSON grids payload. Metadata lists the npy
+    parts in order: freq and slow (when included) followed by each grid.
+    '''
+    metadata = {"parts": [], "grids": []}
+    arrays = []
+    for part_name, array in (("freq", freq), ("slow", slow)):
+        if array is not None:
+            metadata["parts"].append(part_name)
+            arrays.append((part_name, array))
+    for i, grid in enumerate(grids):
+        part_name = f"grid_{i}"
+        metadata["parts"].append(part_name)
+        metadata["grids"].append({"name": grid["name"], "shape": list(grid["data"].shape)})
+        arrays.append((part_name, grid["data"]))
+    return multipart_npy_response(metadata, arrays)
+
+
+def sse_event(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def grid_event_metadata(event):
+    '''JSON-safe part of a record event; the grid itself travels separately.'''
+    grid = event["grid"]
+    return {
+        "type": "record",
+        "jobId": event["jobId"],
+        "index": event["index"],
+        "name": event["name"],
+        "shape": list(grid.shape),
+        "dtype": "<f4",
+    }
+
+
+def grid_sse_event(event):
+    '''
+    Server-sent events are text only, so grids are sent as base64 of the
+    little-endian float32 buffer rather than as JSON numbers.
+    '''
+    data = grid_event_metadata(event)
+    data["data"] = base64.b64encode(as_float32(event["grid"]).astype("<f4", copy=False)).decode()
+    return sse_event("record", data)
+
+
+def grid_binary_frame(event):
+    return memoryview(as_float32(event["grid"]).astype("<f4", copy=False)).cast("B")
@@ -1,10 +1,15 @@
+import io
 import os
 import re
+import tempfile
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
 import segyio
 
+from segy import SegyFile
+
 
 def get_data_from_excel(excel_path):
     xf = pd.ExcelFile(excel_path)
@@ -50,48 +55,118 @@ def get_geometry_from_excel(excel_path):
     ]
 
 
-def close_and_remove_file(path: str):
-    def local_close():
-        os.remove(path)
+def get_upload_buffer(spooled_file):
+    '''
+    Zero-copy source for an uploaded file's contents.
 
-    return local_close
+    Uploads still spooled in memory are returned as a memoryview of the
+    spool buffer. Uploads that rolled over to disk are returned as the
+    spool's underlying file object, which can be memory-mapped.
+    '''
+    spooled_file.seek(0)
+    file = getattr(spooled_file, "_file", spooled_file)
+    if isinstance(file, io.BytesIO):
+        return file.getbuffer()
+    return file
+
+
+def release_upload_buffer(buffer):
+    '''
+    Release a memoryview from get_upload_buffer. The spool cannot be closed
+    while the view is still exported.
+    '''
+    if isinstance(buffer, memoryview):
+        buffer.release()
 
 
-def parse_trace_headers(segyfile, n_traces):
+@contextmanager
+def as_file_path(source):
+    '''
+    Path for libraries that can only open files by name. Paths are passed
+    through; buffers and file objects are written to a temporary file that
+    is removed afterwards.
     '''
-    Taken from https://github.com/equinor/segyio-notebooks/blob/master/notebooks/basic/02_segy_quicklook.ipynb
+    if isinstance(source, (str, os.PathLike)):
+        yield source
+        return
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                f.write(source)
+            else:
+                source.seek(0)
+                while chunk := source.read(1024 * 1024):
+                    f.write(chunk)
+        yield path
+    finally:
+        os.remove(path)
+
 
-    Parse the segy file trace headers into a pandas dataframe.
-    Column names are defined from segyio internal tracefield
-    One row per trace
+GEOMETRY_TRACE_FIELDS = {
+    "GroupX": segyio.TraceField.GroupX,
+    "GroupY": segyio.TraceField.GroupY,
+    "ReceiverGroupElevation": segyio.TraceField.ReceiverGroupElevation,
+    "SourceGroupScalar": segyio.TraceField.SourceGroupScalar,
+    "ElevationScalar": segyio.TraceField.ElevationScalar,
+}
+
+
+def read_trace_fields(segyfile, fields):
+    '''
+    Read only the requested trace header fields as numpy arrays,
+    one value per trace.
     '''
-    # Get all header keys
-    headers = segyio.tracefield.keys
-    # Initialize dataframe with trace id as index and headers as columns
-    df = pd.DataFrame(index=range(1, n_traces + 1),
-                      columns=headers.keys())
-    # Fill dataframe with all header values
-    for k, v in headers.items():
-        df[k] = segyfile.attributes(v)[:]
-    return df
+    return {name: np.asarray(segyfile.attributes(field)[:]) for name, field in fields.items()}
+
+
+def apply_scalar(values, scalar):
+    # Zero scalars are treated as 1, as allowed by the SEG-Y standard
+    scalar = np.abs(scalar).astype(np.float64)
+    scalar[scalar == 0] = 1.0
+    return values / scalar
+
+
+def format_geometry(x_points, y_points, z_points):
+    return [
+        {"index": idx, "x": x, "y": y, "z": z}
+        for idx, (x, y, z) in enumerate(zip(x_points.tolist(), y_points.tolist(), z_points.tolist()))
+    ]
 
 
 def get_geometry_from_sgy(segyfile):
-    with segyio.open(segyfile, ignore_geometry=True) as f:
-        n_traces = f.tracecount
-        trace_headers = parse_trace_headers(f, n_traces)
-        source_group_scalar = np.abs(trace_headers['SourceGroupScalar'])
-        x_points = (trace_headers['GroupX'] / source_group_scalar)
-        y_points = trace_headers['GroupY'] / source_group_scalar
-        elevation_scalar = np.abs(trace_headers['ElevationScalar'])
-        z_points = trace_headers['ReceiverGroupElevation'] / elevation_scalar
+    trace_headers = None
+    try:
+        with SegyFile(segyfile) as f:
+            trace_headers = f.read_trace_fields(GEOMETRY_TRACE_FIELDS.keys())
+    except ValueError:
+        pass
+    if trace_headers is None:
+        # Layouts the memory-mapped reader cannot handle go through segyio.
+        # This runs outside the except block so that the failed reader's
+        # frames, and its views into `segyfile`, are already released.
+        with as_file_path(segyfile) as path, segyio.open(path, ignore_geometry=True) as f:
+            trace_headers = read_trace_fields(f, GEOMETRY_TRACE_FIELDS)
+    x_points = apply_scalar(trace_headers["GroupX"], trace_headers["SourceGroupScalar"])
+    y_points = apply_scalar(trace_headers["GroupY"], trace_headers["SourceGroupScalar"])
+    z_points = apply_scalar(trace_headers["ReceiverGroupElevation"], trace_headers["ElevationScalar"])
 
     # Format as list of dicts for return
-    return [
-        {
-            "index": idx,
-            "x": float(x_points.iloc[idx]),
-            "y": float(y_points.iloc[idx]),
-            "z": float(z_points.iloc[idx]),
-        } for idx in range(len(x_points))
-    ]
\ No newline at end of file
+    return format_geometry(x_points, y_points, z_points)
+
+
+def get_traces_from_sgy(segyfile):
+    '''
+    Read all traces of a segy file as an (n_traces, n_samples) float32 array.
+    Returns the traces and the sample interval in seconds.
+    '''
+    try:
+        with SegyFile(segyfile) as f:
+            return f.read_traces(), f.sample_interval
+    except ValueError:
+        pass
+    # Outside the except block, as in get_geometry_from_sgy
+    with as_file_path(segyfile) as path, segyio.open(path, ignore_geometry=True) as f:
+        traces = segyio.tools.collect(f.trace[:]).astype(np.float32, copy=False)
+        dt = segyio.tools.dt(f) / 1e6
+    return traces, dt
@@ -0,0 +1,463 @@
+import numpy as np
+
+from cache import hash_arrays
+
+# Settings used by CalcCurve in the frontend (frontend/src/utils/disper-util.ts)
+PHASE_VEL_DELTA = 2.0
+VP_VS_RATIO = np.sqrt(3.0)
+DEFAULT_DENSITY = 2.0
+# CalcCurve refines roots to 1%; curves here are also differentiated by the
+# inversion, so roots are refined much further
+RELATIVE_ACCURACY = 1e-6
+MAX_ITERATIONS = 100
+# Velocities per block of the scan grid evaluated in one broadcast. Blocks
+# start small and double, since most roots lie near the start of the scan.
+SCAN_FIRST_BLOCK_VELOCITIES = 8
+SCAN_BLOCK_VELOCITIES = 64
+# Limits on a single curve request, bounding its cost at about
+# MAX_CURVE_PERIODS * MAX_SCAN_STEPS secular function evaluations
+MAX_CURVE_PERIODS = 1000
+MAX_SCAN_STEPS = 20000
+# Problems (model x period) solved together, bounding the size of every
+# temporary regardless of how many models are passed in
+PROBLEMS_PER_CHUNK = 2048
+
+EPS = np.finfo(np.float64).eps
+BIG = 10e10
+
+
+def sh0(x):
+    '''Series for sinh(sqrt(x)) / sqrt(x), accurate for |x| <= 1.'''
+    return 1.0 + x * (1.666666666666667e-1
+        + x * (8.3333333333340e-3
+            + x * (1.984126984127e-4
+                + x * (2.7557319189e-6 + x * (2.50121084e-8
+                    + x * (1.605961e-10 + x * 7.647e-13))))))
+
+
+def propagator_terms(xx):
+    '''
+    cosh(sqrt(xx)) and sinh(sqrt(xx)) / sqrt(xx) for a layer, continued to
+    cos / sin for negative xx. Growing exponentials are divided out: the
+    returned scale is the factor applied (1 / cosh, or 0 when it underflows).
+    '''
+    aa = np.abs(xx)
+    root = np.sqrt(aa)
+    series = aa <= 1
+    oscillating = ~series & (xx <= 0)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        ch = np.where(series, 1 + xx * sh0(xx / 4) * sh0(xx / 4) / 2, np.where(oscillating, np.cos(root), 1.0))
+        sh = np.where(series, sh0(xx), np.where(oscillating, np.sin(root), np.tanh(root)) / root)
+        scale = np.where(series | oscillating, 1.0, np.where(root > 100, 0.0, 1 / np.cosh(np.minimum(root, 100))))
+    return ch, sh, scale
+
+
+def layer_value(param, i, extra_dims):
+    '''Layer `i` of a (..., n_layers) model array, shaped to broadcast over `extra_dims` trailing axes.'''
+    value = param[..., i]
+    return value.reshape(value.shape + (1,) * extra_dims)
+
+
+def secular_function(c, omega, thickness, vp, vs, rho):
+    '''
+    Rayleigh-wave secular function of a layered solid over a half-space,
+    evaluated at phase velocity `c` and angular frequency `omega` (the
+    value raymrx leaves in y0[1] in the frontend solver).
+
+    Model arrays have the layer axis last, shape batch + (n_layers,), with
+    the last layer as the half-space. `c` and `omega` have shape
+    batch + extra and are evaluated element-wise, so any number of
+    periods and velocities is computed in one pass per layer. Returns NaN
+    where `c` is not below the half-space shear velocity.
+    '''
+    thickness, vp, vs, rho = (np.asarray(a, dtype=np.float64) for a in (thickness, vp, vs, rho))
+    c, omega = np.broadcast_arrays(np.asarray(c, dtype=np.float64), np.asarray(omega, dtype=np.float64))
+    extra_dims = c.ndim - (vs.ndim - 1)
+    n_layers = vs.shape[-1]
+
+    cc = c * c
+    wn = omega / c
+    ro = layer_value(rho, n_layers - 1, extra_dims)
+    sv = layer_value(vs, n_layers - 1, extra_dims)
+    roc = ro * cc
+    cp = c / layer_value(vp, n_layers - 1, extra_dims)
+    raa = (1 + cp) * (1 - cp)
+    invalid = c >= sv
+    with np.errstate(invalid="ignore"):
+        ra = np.sqrt(raa)
+        cs = c / sv
+        rbb = (1 + cs) * (1 - cs)
+        rb = np.sqrt(rbb)
+    rg = 2 * ro * sv * sv
+
+    # Half-space starting values
+    y2 = -EPS * (cp * cp * rbb + cs * cs) / (roc * (ra * rb + 1))
+    y1 = rg * y2 + EPS
+    y3 = -ra * EPS
+    y4 = -rb * EPS
+    y5 = -rg * (y1 + EPS) + roc * EPS
+
+    # Integrate upwards through the layers
+    for i in range(n_layers - 2, -1, -1):
+        ro = layer_value(rho, i, extra_dims)
+        sv = layer_value(vs, i, extra_dims)
+        roc = ro * cc
+        r2 = 1 / roc
+        cp = c / layer_value(vp, i, extra_dims)
+        raa = (1 + cp) * (1 - cp)
+        cs = c / sv
+        rbb = (1 + cs) * (1 - cs)
+        hk = layer_value(thickness, i, extra_dims) * wn
+        hkk = hk * hk
+
+        cha, sha, scale_p = propagator_terms(raa * hkk)
+        chb, shb, scale_s = propagator_terms(rbb * hkk)
+        sha = hk * sha
+        shb = hk * shb
+        noq = scale_p * scale_s
+
+        g1 = 2 / cs / cs
+        rg = g1 * roc
+        r4 = rg - roc
+        e1 = cha * chb
+        e2 = e1 - noq
+        e3 = sha * shb
+        e5 = sha * chb
+        e6 = shb * cha
+        f1 = e2 - e3
+        f2 = r2 * f1
+        f3 = g1 * f1 + e3
+        b33 = e1
+        b34 = raa * e3
+        b43 = rbb * e3
+        b25 = -r2 * (f2 + r2 * (e2 - raa * b43))
+        b15 = rg * b25 + f2
+        b16 = -rg * b15 - f3
+        b22 = b16 + e1
+        b12 = rg * b16 - r4 * f3
+        b52 = -rg * b12 + r4 * (rg * f3 + r4 * e3)
+        b23 = r2 * (e5 - rbb * e6)
+        b13 = rg * b23 - e5
+        b42 = -rg * b13 + r4 * e5
+        b24 = r2 * (e6 - raa * e5)
+        b14 = rg * b24 - e6
+        b32 = -rg * b14 + r4 * e6
+        b11 = noq - b16 - b16
+        b21 = b15 + b15
+        b31 = b14 + b14
+        b41 = b13 + b13
+        b51 = b12 + b12
+
+        y1, y2, y3, y4, y5 = (
+            b11 * y1 + b12 * y2 + b13 * y3 + b14 * y4 + b15 * y5,
+            b21 * y1 + b22 * y2 + b23 * y3 + b24 * y4 + b25 * y5,
+            b31 * y1 + b32 * y2 + b33 * y3 + b34 * y4 + b24 * y5,
+            b41 * y1 + b42 * y2 + b43 * y3 + b33 * y4 + b23 * y5,
+            b51 * y1 + b52 * y2 + b42 * y3 + b32 * y4 + b22 * y5,
+        )
+
+        # The result is a ratio, so rescale to keep deep models finite
+        norm = np.maximum.reduce([np.abs(y) for y in (y1, y2, y3, y4, y5)])
+        norm = np.where(norm > BIG, norm * EPS, 1.0)
+        y1, y2, y3, y4, y5 = (y / norm for y in (y1, y2, y3, y4, y5))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = np.where(np.abs(y5) * EPS <= np.abs(y3), y5 / np.abs(y3), np.where(y5 < 0, -BIG, BIG))
+    return np.where(invalid, np.nan, value)
+
+
+def sign(f):
+    return np.where(f < 0, -1.0, 1.0)
+
+
+def scan_brackets(evaluate, n, phase_vel_min, phase_vel_max, phase_vel_delta):
+    '''
+    Evaluate the secular function of n problems on the (problem x velocity)
+    grid of raydsp's scan and locate the first sign change of each in bulk.
+    The grid is evaluated in blocks of up to SCAN_BLOCK_VELOCITIES, and
+    problems drop out of later blocks once resolved.
+
+    `phase_vel_min` is a scalar or one starting velocity per problem.
+
+    Returns (roots, c_low, f_low, c_high, f_high): roots holds exact zeros
+    on the grid, and the brackets are NaN where there is no sign change
+    before phase_vel_max or before the half-space shear velocity.
+    '''
+    phase_vel_min = np.broadcast_to(np.asarray(phase_vel_min, dtype=np.float64), (n,))
+    n_steps = max(1, int(np.floor((phase_vel_max - phase_vel_min.min()) / phase_vel_delta + 0.5)))
+    # Grids starting above the lowest start run past phase_vel_max; treat that as the end
+    beyond = phase_vel_max + 0.5 * phase_vel_delta
+
+    roots, c_low, f_low, c_high, f_high = (np.full(n, np.nan) for _ in range(5))
+    index = np.arange(n)
+    previous_f = None
+    start, block = 0, SCAN_FIRST_BLOCK_VELOCITIES
+    while start <= n_steps:
+        # Only the velocities of the current block are built
+        steps = np.arange(max(start - 1, 0), min(start + block, n_steps + 1))
+        c = phase_vel_min[index, None] + phase_vel_delta * steps
+        f = evaluate(index, c)
+        f[c > beyond] = np.nan
+        if start == 0:
+            exact = f[:, 0] == 0
+            roots[index[exact]] = c[exact, 0]
+            index, c, f = index[~exact], c[~exact], f[~exact]
+        else:
+            # The first column repeats the last velocity of the previous block
+            f[:, 0] = previous_f
+
+        # NaN marks velocities at or above the half-space shear velocity,
+        # where raydsp gives up
+        stop = np.isnan(f[:, 1:]) | (f[:, 1:] * sign(f[:, :-1]) <= 0)
+        has_stop = stop.any(axis=1)
+        k = stop.argmax(axis=1)
+        rows = np.arange(len(index))
+        f_stop = f[rows, k + 1]
+        found = has_stop & ~np.isnan(f_stop)
+
+        exact = found & (f_stop == 0)
+        roots[index[exact]] = c[rows[exact], k[exact] + 1]
+        bracketed = found & ~exact
+        c_low[index[bracketed]] = c[rows[bracketed], k[bracketed]]
+        f_low[index[bracketed]] = f[rows[bracketed], k[bracketed]]
+        c_high[index[bracketed]] = c[rows[bracketed], k[bracketed] + 1]
+        f_high[index[bracketed]] = f_stop[bracketed]
+
+        index, previous_f = index[~has_stop], f[~has_stop, -1]
+        if len(index) == 0:
+            break
+        start, block = start + block, min(2 * block, SCAN_BLOCK_VELOCITIES)
+    return roots, c_low, f_low, c_high, f_high
+
+
+def brent_roots(evaluate, c_low, f_low, c_high, f_high, relative_accuracy):
+    '''
+    Refine every bracket at once with the inverse quadratic / secant /
+    bisection iteration of raydsp. Each step evaluates the unconverged
+    brackets together. Returns NaN where a bracket did not converge.
+    '''
+    running = np.flatnonzero(~np.isnan(c_low))
+    c1, f1 = c_low[running], f_low[running]
+    c2, f2 = c_high[running], f_high[running]
+    e = c1 - c2
+    d = e / 2
+    c3 = c2 + d
+    result = np.full(c_low.shape, np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(MAX_ITERATIONS):
+            if len(running) == 0:
+                break
+            f3 = evaluate(running, c3)
+
+            # Keep the root between c2 and c3, with c3 the best estimate
+            swap = f3 * sign(f2) > 0
+            c1, c2 = np.where(swap, c2, c1), np.where(swap, c1, c2)
+            f1, f2 = np.where(swap, f2, f1), np.where(swap, f1, f2)
+            swap = np.abs(f3) > np.abs(f2)
+            c2, c3 = np.where(swap, c3, c2), np.where(swap, c2, c3)
+            f2, f3 = np.where(swap, f3, f2), np.where(swap, f2, f3)
+            e = c2 - c3
+
+            tolc = c3 * relative_accuracy
+            previous_d = d
+            f32 = f3 / f2
+            f31 = f3 / f1
+            f21 = f2 / f1
+            q = f32 * (e * (1 - f31) + f21 * (f31 - f21) * (c1 - c3))
+            s = (f21 - 1) * (f32 - 1) * (f31 - 1)
+            s = np.where(q < 0, -s, s)
+            q = np.abs(q)
+            d = np.where(q >= e * s - np.abs(tolc * s), e * f32 / (f32 - 1), q / s)
+            d = np.where(np.isfinite(d), d, e / 2)
+
+            zero = f3 == 0
+            result[running[zero]] = c3[zero]
+            c1, f1 = c2, f2
+            c2, f2 = c3, f3
+            c3 = c2 + d
+            converged = ~zero & (np.abs(e) <= tolc)
+            result[running[converged]] = c3[converged]
+
+            small = np.abs(d) <= tolc
+            bisect = small & (np.abs(previous_d) <= tolc)
+            d = np.where(bisect, e / 2, d)
+            c3 = np.where(bisect, c2 + d, np.where(small, c2 + sign(d) * tolc, c3))
+
+            keep = ~(zero | converged)
+            running = running[keep]
+            c1, f1, c2, f2, c3, d = c1[keep], f1[keep], c2[keep], f2[keep], c3[keep], d[keep]
+    return result
+
+
+def bisect_roots(evaluate, c_low, f_low, c_high, relative_accuracy):
+    '''Plain bisection of every bracket, as a fallback for brent_roots.'''
+    result = np.full(c_low.shape, np.nan)
+    running = np.flatnonzero(~np.isnan(c_low))
+    c_low, f_low, c_high = c_low[running], f_low[running], c_high[running]
+    for _ in range(MAX_ITERATIONS):
+        if not (c_high - c_low > relative_accuracy * c_high).any():
+            break
+        c_mid = (c_low + c_high) / 2
+        f_mid = evaluate(running, c_mid)
+        lower = sign(f_mid) == sign(f_low)
+        c_low = np.where(lower, c_mid, c_low)
+        f_low = np.where(lower, f_mid, f_low)
+        c_high = np.where(lower, c_high, c_mid)
+    result[running] = (c_low + c_high) / 2
+    return result
+
+
+def phase_velocities(
+        periods,
+        thickness,
+        vp,
+        vs,
+        rho,
+        phase_vel_min,
+        phase_vel_max,
+        phase_vel_delta=PHASE_VEL_DELTA,
+        relative_accuracy=RELATIVE_ACCURACY,
+):
+    '''
+    Fundamental-mode Rayleigh phase velocity at each period.
+
+    Like raydsp, roots are bracketed by the first sign change of the
+    secular function scanning upwards from `phase_vel_min` in steps of
+    `phase_vel_delta` up to `phase_vel_max`, and then refined. Here the
+    scan is a broadcast over the (period x velocity) grid and all
+    brackets are refined together. Periods with no root in the range, or
+    where the scan reaches the half-space shear velocity first, are NaN.
+    With model arrays of shape batch + (n_layers,) the result has shape
+    batch + periods.shape. `phase_vel_min` may also be an array
+    broadcasting to that shape, to start each scan near a known root.
+    '''
+    periods = np.asarray(periods, dtype=np.float64)
+    vs = np.asarray(vs, dtype=np.float64)
+    shape = vs.shape[:-1] + periods.shape
+    n_layers = vs.shape[-1]
+
+    # Flatten to one problem per (model, period) so that finished problems
+    # can be dropped from later evaluations. Problem i is period
+    # i % n_periods of model i // n_periods.
+    n_periods = periods.size
+    omega = 2 * np.pi / periods.reshape(-1)
+    model = [
+        np.broadcast_to(np.asarray(param, dtype=np.float64), vs.shape).reshape(-1, n_layers)
+        for param in (thickness, vp, vs, rho)
+    ]
+    n = len(model[0]) * n_periods
+    if np.ndim(phase_vel_min):
+        phase_vel_min = np.broadcast_to(phase_vel_min, shape).reshape(-1)
+
+    result = np.empty(n)
+    for chunk_start in range(0, n, PROBLEMS_PER_CHUNK):
+        problems = np.arange(chunk_start, min(chunk_start + PROBLEMS_PER_CHUNK, n))
+        chunk_vel_min = phase_vel_min[problems] if np.ndim(phase_vel_min) else phase_vel_min
+        result[problems] = solve_problems(
+            problems, omega, model, n_periods, chunk_vel_min, phase_vel_max, phase_vel_delta, relative_accuracy
+        )
+    return result.reshape(shape)
+
+
+def solve_problems(problems, omega, model, n_periods, phase_vel_min, phase_vel_max, phase_vel_delta, relative_accuracy):
+    '''Scan and refine the roots of one chunk of flattened problems for phase_velocities.'''
+    def evaluate(index, c):
+        '''Secular function of problems `index` at velocities c, shape (len(index),) or (len(index), k).'''
+        extra = c.ndim - 1
+        w = omega[problems[index] % n_periods].reshape((-1,) + (1,) * extra)
+        rows = problems[index] // n_periods
+        return secular_function(c, w, *(param[rows] for param in model))
+
+    roots, c_low, f_low, c_high, f_high = scan_brackets(
+        evaluate, len(problems), phase_vel_min, phase_vel_max, phase_vel_delta
+    )
+    refined = brent_roots(evaluate, c_low, f_low, c_high, f_high, relative_accuracy)
+
+    # Fall back to bisection where the iteration failed or left its bracket
+    tolerance = relative_accuracy * c_high
+    lost = ~np.isnan(c_low) & ~((refined >= c_low - tolerance) & (refined <= c_high + tolerance))
+    if lost.any():
+        fallback = bisect_roots(evaluate, np.where(lost, c_low, np.nan), f_low, c_high, relative_accuracy)
+        refined[lost] = fallback[lost]
+    return np.where(np.isnan(c_low), roots, refined)
+
+
+def model_from_layers(layers):
+    '''
+    (thickness, vp, vs, rho) arrays from DisperSettingsModel layers, with
+    Vp estimated as Vs * sqrt(3) as in the frontend. Layers are dicts with
+    startDepth, endDepth, velocity and density; the last one is the
+    half-space.
+    '''
+    if not layers:
+        raise ValueError("At least one layer is required.")
+    thickness = np.array([layer["endDepth"] - layer["startDepth"] for layer in layers], dtype=np.float64)
+    vs = np.array([layer["velocity"] for layer in layers], dtype=np.float64)
+    rho = np.array([layer.get("density") or DEFAULT_DENSITY for layer in layers], dtype=np.float64)
+    if np.any(vs <= 0):
+        raise ValueError("Layer velocities must be positive.")
+    if np.any(thickness[:-1] <= 0):
+        raise ValueError("Layer thicknesses must be positive.")
+    return thickness, vs * VP_VS_RATIO, vs, rho
+
+
+def check_curve_range(periods, phase_vel_min, phase_vel_max, phase_vel_delta=PHASE_VEL_DELTA):
+    '''Reject invalid curve requests, and ones whose scan would be too large to serve.'''
+    if np.size(periods) > MAX_CURVE_PERIODS:
+        raise ValueError(f"At most {MAX_CURVE_PERIODS} periods per curve.")
+    if np.any(np.asarray(periods) <= 0):
+        raise ValueError("Periods must be positive.")
+    if phase_vel_min <= 0 or phase_vel_max <= phase_vel_min or phase_vel_delta <= 0:
+        raise ValueError("Invalid phase velocity range.")
+    if (phase_vel_max - phase_vel_min) / phase_vel_delta > MAX_SCAN_STEPS:
+        raise ValueError(f"The velocity range spans more than {MAX_SCAN_STEPS} steps of the velocity delta.")
+
+
+def curve_from_layers(layers, periods, phase_vel_min, phase_vel_max, phase_vel_delta=PHASE_VEL_DELTA):
+    '''Phase velocity per period for DisperSettingsModel layers, NaN where there is no root.'''
+    periods = np.asarray(periods, dtype=np.float64)
+    check_curve_range(periods, phase_vel_min, phase_vel_max, phase_vel_delta)
+    thickness, vp, vs, rho = model_from_layers(layers)
+    return phase_velocities(periods, thickness, vp, vs, rho, phase_vel_min, phase_vel_max, phase_vel_delta)
+
+
+def curve_axis_from_settings(settings):
+    '''
+    Periods and phase velocity search range of the disper page curve, as
+    the frontend derives them from curveAxisLimits, numPoints and the axis
+    units: numPoints evenly spaced periods across the period axis, and
+    velocities from 0.9 times the lowest to 1.1 times the highest on the
+    velocity axis.
+    '''
+    limits = settings["curveAxisLimits"]
+    swapped = settings.get("axesSwapped", False)
+    period_min, period_max = (limits["ymin"], limits["ymax"]) if swapped else (limits["xmin"], limits["xmax"])
+    vel_min, vel_max = (limits["xmin"], limits["xmax"]) if swapped else (limits["ymin"], limits["ymax"])
+    if min(period_min, period_max, vel_min, vel_max) <= 0:
+        raise ValueError("Curve axis limits must be positive.")
+
+    if settings.get("periodUnit") == "frequency":
+        period_min, period_max = 1 / period_max, 1 / period_min
+    if settings.get("velocityUnit") == "slowness":
+        vel_min, vel_max = 1 / vel_max, 1 / vel_min
+    n_points = max(2, int(settings["numPoints"]))
+    if n_points > MAX_CURVE_PERIODS:
+        raise ValueError(f"At most {MAX_CURVE_PERIODS} curve points.")
+    periods = np.sort(np.linspace(period_min, period_max, n_points))
+    check_curve_range(periods, 0.9 * vel_min, 1.1 * vel_max)
+    return periods, 0.9 * vel_min, 1.1 * vel_max
+
+
+def curve_key(thickness, vp, vs, rho, periods, phase_vel_min, phase_vel_max, phase_vel_delta=PHASE_VEL_DELTA):
+    '''
+    Canonical hash of a forward problem. The half-space thickness does not
+    affect the curve, so it is left out.
+    '''
+    thickness = np.array(thickness, dtype=np.float64)
+    thickness[-1] = 0.0
+    return hash_arrays(
+        thickness,
+        *(np.asarray(values, dtype=np.float64) for values in (vp, vs, rho, periods)),
+        np.array([phase_vel_min, phase_vel_max, phase_vel_delta], dtype=np.float64),
+    )